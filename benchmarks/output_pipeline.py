@@ -0,0 +1,201 @@
+"""
+Benchmark of the output pipeline: a fake KOTLINC writes about 100 MB of
+output (numbered lines, progress bars redrawn with carriage returns and
+stack traces on stderr), which a ScriptTab of the App runs and shows, from
+the engine and the runner (with the terminal and the search index) to the
+output pane.
+
+Reports the throughput, the ticks of ScriptTab.update_output() and how late
+a timer that should fire every probe_interval fires, which is how long a
+click would have to wait.
+
+First compares how long events wait in a queue, from the put of a thread to
+the drain on the Tcl event loop, when the loop polls the queue every
+poll_interval and when the thread wakes it up through a ui_helpers.Waker.
+This part needs no display.
+
+Needs a display, e.g.: xvfb-run python benchmarks/output_pipeline.py
+Usage: python benchmarks/output_pipeline.py [--megabytes N] [--events N]
+"""
+import argparse
+import os
+from queue import Empty, Queue
+import random
+import threading
+import stat
+import sys
+import tempfile
+import time
+import tkinter as tk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kotlin-workspace'))
+
+import engine  # noqa: E402
+import ui  # noqa: E402
+import ui_helpers  # noqa: E402
+
+probe_interval = 10  # ms
+poll_interval = 100  # ms, how often the output pane polled before the Waker
+
+
+def write_output(directory, megabytes):
+    """
+    Writes the output of the fake script and returns the paths of its
+    stdout and stderr.
+    """
+    stdout_path = os.path.join(directory, 'stdout.txt')
+    stderr_path = os.path.join(directory, 'stderr.txt')
+    size = megabytes * 10**6
+    with open(stdout_path, 'w') as stdout, open(stderr_path, 'w') as stderr:
+        written = 0
+        line = 0
+        while written < size:
+            parts = []
+            for _ in range(1000):
+                parts.append(f'[{line}] processed item {line * 7} in {line % 13} ms\n')
+                line += 1
+            parts.extend(f'\r[{"#" * (percent // 5):20}] {percent}%' for percent in range(0, 101, 5))
+            parts.append('\n')
+            text = ''.join(parts)
+            stdout.write(text)
+            written += len(text)
+            if line % 20000 == 0:
+                trace = (
+                    'Exception in thread "main" java.lang.IllegalStateException: boom\n'
+                    f'\tat Script.<init>(script.kts:{line % 100})\n'
+                    + '\tat java.base/jdk.internal.reflect.Method.invoke(Native Method)\n' * 20
+                )
+                stderr.write(trace)
+                written += len(trace)
+    return stdout_path, stderr_path
+
+
+def install_fake_kotlinc(directory, stdout_path, stderr_path):
+    path = os.path.join(directory, engine.toolchain.KOTLINC)
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\ncat {stderr_path} >&2 &\ncat {stdout_path}\nwait\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    os.environ['PATH'] = f'{directory}{os.pathsep}{os.environ["PATH"]}'
+
+
+def queue_latencies(event_count, use_waker):
+    """
+    Puts event_count events into a queue from a thread, at random intervals
+    of up to 50 ms, and returns the sorted times from each put until the Tcl
+    event loop drained the event.
+    """
+    root = tk.Tcl()
+    queue = Queue()
+    latencies = []
+    poll_job = None
+
+    def drain():
+        while True:
+            try:
+                put_time = queue.get_nowait()
+            except Empty:
+                break
+            latencies.append(time.monotonic() - put_time)
+
+    def poll():
+        nonlocal poll_job
+        drain()
+        poll_job = root.after(poll_interval, poll)
+
+    if use_waker:
+        waker = ui_helpers.Waker(root, drain)
+    else:
+        poll()
+
+    def produce():
+        for _ in range(event_count):
+            time.sleep(random.uniform(0, 0.05))
+            queue.put(time.monotonic())
+            if use_waker:
+                waker.wake()
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    # a Tcl interpreter without windows has no mainloop() that waits for them
+    while len(latencies) < event_count:
+        root.tk.dooneevent()
+    producer.join()
+    # drop the callbacks, which refer to the interpreter, so that it is
+    # deleted in this thread rather than by a later collection in another
+    if use_waker:
+        waker.close()
+    else:
+        root.after_cancel(poll_job)
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--megabytes', type=int, default=100, help="size of the output (default: %(default)s)")
+    parser.add_argument(
+        '--events', type=int, default=200, help="events for the comparison of the wakeups (default: %(default)s)"
+    )
+    args = parser.parse_args()
+
+    for name, use_waker in ((f"{poll_interval} ms poll", False), ("Waker", True)):
+        latencies = queue_latencies(args.events, use_waker)
+        print(
+            f"{name}: put to drain median {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+            f"99th percentile {latencies[len(latencies) * 99 // 100] * 1000:.1f} ms, "
+            f"longest {latencies[-1] * 1000:.1f} ms"
+        )
+
+    with tempfile.TemporaryDirectory() as directory:
+        stdout_path, stderr_path = write_output(directory, args.megabytes)
+        install_fake_kotlinc(directory, stdout_path, stderr_path)
+        size = os.path.getsize(stdout_path) + os.path.getsize(stderr_path)
+
+        # keep the caches of the App out of the way
+        os.environ['XDG_CACHE_HOME'] = os.path.join(directory, 'cache')
+        try:
+            app = ui.App()
+        except tk.TclError as e:
+            sys.exit(f"Needs a display: {e}")
+        tab = app.current_tab
+
+        ticks = []
+        update_output = tab.update_output
+
+        def timed_update_output():
+            tick_start = time.monotonic()
+            update_output()
+            ticks.append(time.monotonic() - tick_start)
+        tab.update_output = timed_update_output
+
+        delays = []
+
+        def probe(expected):
+            now = time.monotonic()
+            delays.append(now - expected)
+            if not tab.busy:
+                app.root.quit()
+                return
+            app.root.after(probe_interval, probe, now + probe_interval / 1000)
+
+        start = time.monotonic()
+        tab.run_script()
+        app.root.after(probe_interval, probe, start + probe_interval / 1000)
+        app.root.mainloop()
+        elapsed = time.monotonic() - start
+        line_count = tab.spool.line_count
+        app.root.destroy()
+
+    ticks.sort()
+    delays.sort()
+    print(f"{size / 10**6:.0f} MB in {elapsed:.2f}s: {size / 10**6 / elapsed:.1f} MB/s, {line_count} lines")
+    print(
+        f"update_output(): {len(ticks)} ticks, median {ticks[len(ticks) // 2] * 1000:.1f} ms, "
+        f"longest {ticks[-1] * 1000:.1f} ms (budget {ui.ScriptTab.frame_budget * 1000:.0f} ms)"
+    )
+    print(
+        f"{probe_interval} ms timer: median delay {delays[len(delays) // 2] * 1000:.1f} ms, "
+        f"longest {delays[-1] * 1000:.1f} ms"
+    )
+
+
+if __name__ == '__main__':
+    main()
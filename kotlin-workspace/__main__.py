@@ -1,5 +1,11 @@
-import ui
+import sys
 
 
 if __name__ == '__main__':
-	ui.main()
+	if sys.argv[1:2] in (['run'], ['check'], ['cds']):
+		# headless, must not require Tk
+		import cli
+		sys.exit(cli.main(sys.argv[1:]))
+	else:
+		import ui
+		ui.main()
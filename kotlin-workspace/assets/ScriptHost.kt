@@ -0,0 +1,211 @@
+/*
+ * JVM side of Kotlin Workspace.
+ *
+ * Usage:
+ *     ScriptHostKt run <jar> <class>
+ *         Runs a script that has been compiled into <jar> before.
+ *     ScriptHostKt daemon
+ *         Keeps the Kotlin compiler loaded and warm. Reads a secret token from
+ *         the first line of stdin, prints "PORT <n>" and then serves one
+ *         request per connection on 127.0.0.1:<n>. A request is a single line
+ *         that starts with the token and a TAB (connections that do not send
+ *         it are closed right away), followed by:
+ *             ping                  -> answered with "pong"
+ *             script<TAB><path>     -> compiles and evaluates the script
+ *             compile<TAB><path><TAB><jar>
+ *                                   -> compiles the script into <jar>
+ *             run<TAB><jar><TAB><class>
+ *                                   -> runs a compiled script
+ *         Output of a script is sent back as frames of the form
+ *         <kind: byte><length: int32><payload>, where kind is 'o' (stdout),
+ *         'e' (stderr) or 'x' (exit code as int32, always the last frame).
+ *         Sending any byte (or closing the connection) while a script runs
+ *         interrupts it.
+ */
+
+import org.jetbrains.kotlin.cli.jvm.K2JVMCompiler
+import java.io.BufferedOutputStream
+import java.io.DataOutputStream
+import java.io.File
+import java.io.IOException
+import java.io.InputStream
+import java.io.OutputStream
+import java.io.PrintStream
+import java.lang.reflect.InvocationTargetException
+import java.net.InetAddress
+import java.net.ServerSocket
+import java.net.Socket
+import java.net.URLClassLoader
+import java.security.MessageDigest
+import kotlin.system.exitProcess
+
+const val STDOUT = 'o'.code
+const val STDERR = 'e'.code
+const val EXIT = 'x'.code
+const val REQUEST_TIMEOUT = 5000 // ms
+
+class FrameWriter(stream: OutputStream) {
+    private val out = DataOutputStream(BufferedOutputStream(stream))
+
+    @Synchronized
+    fun write(kind: Int, bytes: ByteArray, offset: Int, length: Int) {
+        out.writeByte(kind)
+        out.writeInt(length)
+        out.write(bytes, offset, length)
+        out.flush()
+    }
+
+    @Synchronized
+    fun writeExit(code: Int) {
+        out.writeByte(EXIT)
+        out.writeInt(4)
+        out.writeInt(code)
+        out.flush()
+    }
+}
+
+class FrameOutputStream(private val writer: FrameWriter, private val kind: Int) : OutputStream() {
+    override fun write(b: Int) = write(byteArrayOf(b.toByte()), 0, 1)
+
+    override fun write(b: ByteArray, off: Int, len: Int) {
+        if (len > 0) writer.write(kind, b, off, len)
+    }
+}
+
+fun readLine(input: InputStream): String? {
+    val line = StringBuilder()
+    while (true) {
+        val b = input.read()
+        if (b < 0) return if (line.isEmpty()) null else line.toString()
+        if (b == '\n'.code) return line.toString()
+        line.append(b.toChar())
+    }
+}
+
+fun evaluate(kotlinHome: String, path: String, err: PrintStream): Int = try {
+    K2JVMCompiler().exec(err, "-kotlin-home", kotlinHome, "-script", path).code
+} catch (e: Throwable) {
+    e.printStackTrace(err)
+    1
+}
+
+fun compile(kotlinHome: String, path: String, jar: String, err: PrintStream): Int = try {
+    K2JVMCompiler().exec(
+        err, "-kotlin-home", kotlinHome, "-Xallow-any-scripts-in-source-roots", "-d", jar, path
+    ).code
+} catch (e: Throwable) {
+    e.printStackTrace(err)
+    1
+}
+
+fun runCompiled(jar: String, className: String, err: PrintStream): Int =
+    URLClassLoader(arrayOf(File(jar).toURI().toURL()), Thread.currentThread().contextClassLoader).use { loader ->
+        val scriptClass = loader.loadClass(className)
+        val constructor = scriptClass.constructors.firstOrNull {
+            it.parameterTypes.contentEquals(arrayOf(Array<String>::class.java))
+        }
+        try {
+            if (constructor != null) {
+                constructor.newInstance(*arrayOf<Any?>(arrayOf<String>()))
+            } else {
+                scriptClass.getDeclaredConstructor().newInstance()
+            }
+            0
+        } catch (e: InvocationTargetException) {
+            e.targetException.printStackTrace(err)
+            1
+        }
+    }
+
+fun handle(socket: Socket, kotlinHome: String, token: ByteArray) {
+    val input = socket.getInputStream()
+    // so that a client that never sends a request does not block the daemon
+    socket.soTimeout = REQUEST_TIMEOUT
+    val line = (readLine(input) ?: return).toByteArray(Charsets.ISO_8859_1)
+    socket.soTimeout = 0
+    val separator = line.indexOf('\t'.code.toByte())
+    // compared in constant time so that the token cannot be guessed byte by byte
+    if (separator < 0 || !MessageDigest.isEqual(line.copyOfRange(0, separator), token)) return
+    val request = String(line, separator + 1, line.size - separator - 1, Charsets.UTF_8)
+    val args = request.split('\t')
+    when (args[0]) {
+        "ping" -> {
+            socket.getOutputStream().write("pong\n".toByteArray())
+            return
+        }
+        "script", "compile", "run" -> {}
+        else -> return
+    }
+
+    val frames = FrameWriter(socket.getOutputStream())
+    val out = PrintStream(FrameOutputStream(frames, STDOUT), true, "UTF-8")
+    val err = PrintStream(FrameOutputStream(frames, STDERR), true, "UTF-8")
+    val originalOut = System.out
+    val originalErr = System.err
+    var exitCode = 1
+
+    val worker = Thread {
+        exitCode = when (args[0]) {
+            "script" -> evaluate(kotlinHome, args[1], err)
+            "compile" -> compile(kotlinHome, args[1], args[2], err)
+            else -> try {
+                runCompiled(args[1], args[2], err)
+            } catch (e: Throwable) {
+                e.printStackTrace(err)
+                1
+            }
+        }
+    }
+    System.setOut(out)
+    System.setErr(err)
+    try {
+        worker.start()
+        val watcher = Thread {
+            try {
+                input.read()
+            } catch (e: IOException) {
+            }
+            worker.interrupt()
+        }
+        watcher.isDaemon = true
+        watcher.start()
+        worker.join()
+    } finally {
+        System.setOut(originalOut)
+        System.setErr(originalErr)
+    }
+    out.flush()
+    err.flush()
+    frames.writeExit(exitCode)
+}
+
+fun serve(kotlinHome: String) {
+    val token = readLine(System.`in`)
+    if (token.isNullOrEmpty()) {
+        System.err.println("No token on stdin")
+        exitProcess(2)
+    }
+    val tokenBytes = token.toByteArray(Charsets.ISO_8859_1)
+    val server = ServerSocket(0, 1, InetAddress.getLoopbackAddress())
+    println("PORT ${server.localPort}")
+    System.out.flush()
+    while (true) {
+        try {
+            server.accept().use { handle(it, kotlinHome, tokenBytes) }
+        } catch (e: IOException) {
+            // the client went away, wait for the next one
+        }
+    }
+}
+
+fun main(args: Array<String>) {
+    val kotlinHome = System.getProperty("kotlin.home")
+    when (args.firstOrNull()) {
+        "daemon" -> serve(kotlinHome)
+        "run" -> exitProcess(runCompiled(args[1], args[2], System.err))
+        else -> {
+            System.err.println("Usage: ScriptHostKt run <jar> <class> | ScriptHostKt daemon")
+            exitProcess(2)
+        }
+    }
+}
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import toolchain
+
+
+class ScriptCache:
+    """
+    Content-addressed store of compiled scripts.
+
+    Entries are jars keyed on the script text, the compiler version and the JVM
+    options. When the total size exceeds max_size, the least recently used
+    entries are evicted (recency is tracked through the file modification
+    time, so it survives restarts and is shared between processes).
+    """
+    max_size = 256 * 1024 * 1024  # bytes
+
+    def __init__(self, directory=None, max_size=None):
+        self.directory = directory or toolchain.cache_dir('scripts')
+        if max_size is not None:
+            self.max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compile_seconds = 0.0  # spent on misses
+        self.saved_seconds = 0.0  # compile time avoided by hits
+        # key -> asyncio.Future of compiles in progress, only used from the
+        # event loop that runs the scripts
+        self.compiling = {}
+
+    @staticmethod
+    def key(script, compiler_version, jvm_options=()):
+        digest = hashlib.sha256()
+        for part in (script, compiler_version, *jvm_options):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _jar(self, key):
+        return os.path.join(self.directory, f'{key}.jar')
+
+    def _meta(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def partial_jar(self, key):
+        """
+        Returns a path to compile into before the result is put().
+        """
+        directory = os.path.join(self.directory, 'partial')
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f'{key}-{os.getpid()}-{threading.get_ident()}.jar')
+
+    def get(self, key):
+        """
+        Returns the path of the cached jar or None. Counts as a hit or miss.
+        """
+        jar = self._jar(key)
+        try:
+            os.utime(jar)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            with open(self._meta(key)) as f:
+                compile_seconds = json.load(f)['compile_seconds']
+        except (OSError, ValueError, KeyError):
+            compile_seconds = 0.0
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += compile_seconds
+        return jar
+
+    def put(self, key, jar, compile_seconds):
+        """
+        Moves the compiled jar into the cache and returns its new path.
+        """
+        target = self._jar(key)
+        shutil.move(jar, target)
+        with open(self._meta(key), 'w') as f:
+            json.dump({'compile_seconds': compile_seconds}, f)
+        with self._lock:
+            self.compile_seconds += compile_seconds
+        self.evict(keep=key)
+        return target
+
+    def entries(self):
+        """
+        Returns (mtime, size, key) of all entries, least recently used first.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.jar'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.name[:-len('.jar')]))
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the total size is at
+        most max_size, except the entry of the key keep (which may be larger
+        than max_size on its own).
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            for path in (self._jar(key), self._meta(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            for path in (self._jar(key), self._meta(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        entries = self.entries()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'size': sum(size for _, size, _ in entries),
+                'max_size': self.max_size,
+                'compile_seconds': self.compile_seconds,
+                'saved_seconds': self.saved_seconds,
+            }
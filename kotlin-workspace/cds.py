@@ -0,0 +1,142 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import toolchain
+
+
+class ClassDataArchive:
+    """
+    AppCDS archive of the classes that KOTLINC loads, which saves the JVM most
+    of the class loading at startup.
+
+    The archive is created once by dumping the classes of a trivial script run
+    (which needs JDK 13 or newer) and is keyed on the Kotlin installation and
+    the Java runtime, because the JVM ignores archives of other class paths or
+    runtimes. Archives of previous installations are stale and get replaced by
+    the next create().
+    """
+    script = 'println("")\n'  # run to collect the classes
+
+    def __init__(self, directory=None):
+        self.directory = directory or toolchain.cache_dir('cds')
+        self.error = None  # of the last create()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def key():
+        """
+        Returns the key for the current installation or None if there is
+        none.
+        """
+        kotlin_home = toolchain.find_kotlin_home()
+        java = shutil.which(toolchain.find_java())
+        if kotlin_home is None or java is None:
+            return None
+        java = os.path.realpath(java)
+        stat = os.stat(java)
+        digest = hashlib.sha256()
+        for part in (kotlin_home, toolchain.kotlin_version(kotlin_home), java, str(stat.st_mtime_ns)):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()[:16]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'kotlinc-{key}.jsa')
+
+    def _archives(self):
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith('.jsa')
+        ]
+
+    @property
+    def creating(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def state(self):
+        """
+        Returns (state, size) where state is 'creating', 'present', 'stale'
+        or 'missing' and size is that of the current archive in bytes.
+        """
+        if self.creating:
+            return 'creating', 0
+        key = self.key()
+        if key is not None:
+            try:
+                return 'present', os.path.getsize(self._path(key))
+            except FileNotFoundError:
+                pass
+        return ('stale' if self._archives() else 'missing'), 0
+
+    def java_options(self):
+        """
+        Returns the JVM options that use the archive, or () if it is not
+        present.
+        """
+        key = self.key()
+        if key is None or not os.path.exists(self._path(key)):
+            return ()
+        return (f'-XX:SharedArchiveFile={self._path(key)}',)
+
+    def create(self):
+        """
+        Creates the archive for the current installation if it is not present
+        yet and deletes stale ones. Blocks until KOTLINC has run the script.
+        """
+        with self._lock:
+            key = self.key()
+            if key is None:
+                self.error = f"{toolchain.KOTLINC} not found. Please make sure it is in your PATH."
+                return False
+            path = self._path(key)
+            if os.path.exists(path):
+                return True
+
+            directory = tempfile.mkdtemp(prefix='kotlin-workspace-cds-')
+            partial = os.path.join(directory, 'archive.jsa')
+            try:
+                with open(os.path.join(directory, 'script.kts'), 'w') as f:
+                    f.write(self.script)
+                environment = dict(os.environ, JAVA_OPTS=' '.join([
+                    os.environ.get('JAVA_OPTS', ''), f'-XX:ArchiveClassesAtExit={partial}'
+                ]).strip())
+                try:
+                    result = subprocess.run(
+                        [toolchain.KOTLINC, '-script', 'script.kts'],
+                        cwd=directory,
+                        env=environment,
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT
+                    )
+                except FileNotFoundError:
+                    self.error = f"{toolchain.KOTLINC} not found. Please make sure it is in your PATH."
+                    return False
+                if result.returncode != 0 or not os.path.exists(partial):
+                    self.error = f"Could not create the class data archive:\n{result.stdout.decode(errors='replace')}"
+                    return False
+
+                for stale in self._archives():
+                    os.remove(stale)
+                os.replace(partial, path)
+                self.error = None
+                return True
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def create_in_background(self):
+        if self.creating:
+            return
+        self._thread = threading.Thread(target=self.create, daemon=True)
+        self._thread.start()
+
+    def clear(self):
+        with self._lock:
+            for archive in self._archives():
+                os.remove(archive)
@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import cache
+import cds
+import engine
+import pool
+import timings
+import toolchain
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='kotlin-workspace')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', description="Run Kotlin scripts without the GUI.")
+    run_parser.add_argument('files', nargs='+', metavar='FILE', help="scripts to run")
+    check_parser = commands.add_parser(
+        'check', description="Compile Kotlin scripts without running them and report the diagnostics."
+    )
+    check_parser.add_argument('files', nargs='+', metavar='FILE', help="scripts to check")
+    for command_parser in (run_parser, check_parser):
+        add_options(command_parser)
+    cds_parser = commands.add_parser(
+        'cds', description=f"Manage the class data archive that speeds up the startup of {toolchain.KOTLINC}."
+    )
+    cds_parser.add_argument(
+        'action', nargs='?', default='status', choices=['status', 'create', 'clear', 'benchmark'],
+        help="benchmark compares the time of a trivial script with and without the archive (default: %(default)s)"
+    )
+    cds_parser.add_argument('-n', '--repeat', type=int, default=5, help="runs per benchmark case (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def add_options(parser):
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help="maximum number of scripts to run at the same time (default: based on CPU count and free memory)"
+    )
+    parser.add_argument('--json', action='store_true', help="print one JSON object per script")
+    parser.add_argument(
+        '--log-dir', default='kotlin-workspace-logs',
+        help="directory for the stdout/stderr logs of each script (default: %(default)s)"
+    )
+    parser.add_argument('--timeout', type=float, default=None, help="wall-clock limit per script in seconds")
+    parser.add_argument('--cpu-limit', type=float, default=None, help="CPU time limit per script in seconds")
+    parser.add_argument('--memory-limit', type=int, default=None, help="memory (RSS) limit per script in MiB")
+    parser.add_argument('--cache', action='store_true', help="use the compiled script cache")
+    parser.add_argument(
+        '--cds', action='store_true', help=f"use a class data archive for {toolchain.KOTLINC} (see the cds command)"
+    )
+    parser.add_argument(
+        '--timings', metavar='FILE',
+        help="append the phase timings of each script to this JSON-lines file and write a Chrome trace next to it"
+    )
+    parser.add_argument(
+        '--spares', type=int, default=0,
+        help="number of warm JVMs to keep ready for the next script (default: %(default)s)"
+    )
+    parser.add_argument('--encoding', default='utf-8', help="encoding of the script output (default: %(default)s)")
+
+
+def log_paths(files, log_dir):
+    """
+    Returns a unique (stdout log, stderr log) for each file.
+    """
+    paths = []
+    used = set()
+    for file in files:
+        stem = os.path.splitext(os.path.basename(file))[0]
+        name = stem
+        counter = 1
+        while name in used:
+            counter += 1
+            name = f'{stem}-{counter}'
+        used.add(name)
+        paths.append((
+            os.path.join(log_dir, f'{name}.stdout.log'),
+            os.path.join(log_dir, f'{name}.stderr.log')
+        ))
+    return paths
+
+
+async def run_file(file, logs, options, timing_records=None):
+    """
+    Runs a script file, writing its output to the logs. Returns a summary.
+    The timings.record() of the run is appended to timing_records.
+    """
+    try:
+        with open(file) as f:
+            script = f.read()
+    except OSError as e:
+        return {'file': file, 'exit_code': None, 'reason': 'unreadable', 'error': str(e)}
+
+    script_run = engine.ScriptRun(script, measure_usage=True, **options)
+    stdout_log, stderr_log = logs
+    # compiler output is small enough to keep for parsing the diagnostics
+    compiler_output = [] if script_run.compile_only else None
+    with open(stdout_log, 'w', encoding='utf-8') as stdout, open(stderr_log, 'w', encoding='utf-8') as stderr:
+        async for event in script_run:
+            if event.kind == 'stdout':
+                stdout.write(event.chunk)
+            elif event.kind == 'stderr':
+                stderr.write(event.chunk)
+                if compiler_output is not None:
+                    compiler_output.append(event.chunk)
+
+    timing_record = timings.record(script_run, file=file)
+    if timing_records is not None:
+        timing_records.append(timing_record)
+
+    result = {
+        'file': file,
+        'exit_code': script_run.exit.code,
+        'reason': script_run.exit.reason,
+        'wall_seconds': script_run.wall_seconds,
+        'first_output_seconds': script_run.first_output_seconds,
+        'stop_seconds': script_run.stop_seconds,
+        'phases': timing_record['phases'],
+        'cpu_seconds': script_run.usage.cpu_seconds,
+        'peak_rss': script_run.usage.peak_rss,
+        'stdout_log': stdout_log,
+        'stderr_log': stderr_log,
+    }
+    if compiler_output is not None:
+        result['diagnostics'] = [
+            diagnostic._asdict() for diagnostic in engine.parse_diagnostics(''.join(compiler_output))
+        ]
+    return result
+
+
+def format_result(result):
+    if result['exit_code'] is None:
+        return f"{result['file']}: {result['error']}"
+    status = f"killed: {result['reason']}" if result['reason'] else f"exit code {result['exit_code']}"
+    lines = [
+        f"{result['file']}:{diagnostic['row']}:{diagnostic['col']}: {diagnostic['severity']}: {diagnostic['message']}"
+        for diagnostic in result.get('diagnostics', ())
+    ]
+    first_output = ''
+    if result['first_output_seconds'] is not None:
+        first_output = f", first output after {result['first_output_seconds']:.2f}s"
+    return '\n'.join(lines + [
+        f"{result['file']}: {status} after {result['wall_seconds']:.2f}s "
+        f"(CPU {result['cpu_seconds']:.2f}s, peak RSS {result['peak_rss'] / 2**20:.0f} MiB{first_output})"
+    ])
+
+
+async def run_files(args):
+    os.makedirs(args.log_dir, exist_ok=True)
+    spare_pool = pool.SparePool(args.spares)
+    spare_pool.fill()
+    options = dict(
+        scheduler=engine.Scheduler(args.jobs),
+        cache=cache.ScriptCache() if args.cache else None,
+        timeout=args.timeout,
+        cpu_limit=args.cpu_limit,
+        memory_limit=args.memory_limit * 2**20 if args.memory_limit is not None else None,
+        encoding=args.encoding,
+        compile_only=args.command == 'check',
+        pool=spare_pool,
+        cds=cds.ClassDataArchive() if args.cds else None
+    )
+
+    succeeded = True
+    timing_records = []
+    # Scripts that cannot run yet wait here rather than in the scheduler, so
+    # that they do not keep their logs open (there may be hundreds).
+    slots = asyncio.Semaphore(max(1, args.jobs or os.cpu_count() or 1))
+
+    async def run_in_slot(file, logs):
+        async with slots:
+            return await run_file(file, logs, options, timing_records)
+
+    runs = [run_in_slot(file, logs) for file, logs in zip(args.files, log_paths(args.files, args.log_dir))]
+    try:
+        for run in asyncio.as_completed(runs):
+            result = await run
+            succeeded = succeeded and result['exit_code'] == 0
+            print(json.dumps(result) if args.json else format_result(result), flush=True)
+    finally:
+        await spare_pool.shutdown()
+    if args.timings:
+        timings.append_json_lines(args.timings, timing_records)
+        timings.write_trace(f'{os.path.splitext(args.timings)[0]}.trace.json', timing_records)
+    return succeeded
+
+
+def format_archive_state(archive):
+    state, size = archive.state()
+    return f"{state} ({size / 2**20:.0f} MiB)" if state == 'present' else state
+
+
+async def benchmark_archive(archive, repeat):
+    """
+    Returns the wall times of repeated runs of a trivial script without and
+    with the archive.
+    """
+    times = {}
+    for case, case_archive in (('without', None), ('with', archive)):
+        times[case] = []
+        for _ in range(repeat):
+            script_run = engine.ScriptRun(archive.script, cds=case_archive)
+            async for _ in script_run:
+                pass
+            if script_run.exit.code != 0:
+                raise toolchain.ToolchainError(f"The benchmark script failed with exit code {script_run.exit.code}.")
+            times[case].append(script_run.wall_seconds)
+    return times
+
+
+def manage_archive(args):
+    archive = cds.ClassDataArchive()
+    if args.action == 'clear':
+        archive.clear()
+    elif args.action in ('create', 'benchmark'):
+        if not archive.create():
+            print(archive.error, file=sys.stderr)
+            return 1
+    print(f"Class data archive: {format_archive_state(archive)}")
+
+    if args.action == 'benchmark':
+        try:
+            times = asyncio.run(benchmark_archive(archive, args.repeat))
+        except toolchain.ToolchainError as e:
+            print(e, file=sys.stderr)
+            return 1
+        for case, case_times in times.items():
+            print(
+                f"{case} archive: mean {sum(case_times) / len(case_times):.2f}s, "
+                f"min {min(case_times):.2f}s over {len(case_times)} runs"
+            )
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command == 'cds':
+        return manage_archive(args)
+    return 0 if asyncio.run(run_files(args)) else 1
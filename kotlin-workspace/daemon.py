@@ -0,0 +1,275 @@
+import asyncio
+import codecs
+import functools
+import os
+import secrets
+import shutil
+import signal
+import struct
+import tempfile
+import weakref
+
+import processes
+import toolchain
+
+
+class DaemonError(Exception):
+    pass
+
+
+class ScriptDaemon:
+    """
+    Keeps a long-lived JVM that hosts the Kotlin compiler (see
+    assets/ScriptHost.kt) so that runs do not pay for the JVM and compiler
+    startup each time.
+
+    The daemon evaluates one script at a time. If it dies (e.g., because it ran
+    out of memory) or does not react to a cancellation in time, it is restarted
+    in the background, unless it is being shut down.
+
+    Scripts evaluated by the daemon share its working directory, which is a
+    scratch directory of its own rather than that of the caller.
+
+    The daemon listens on a loopback port, which any local user can connect
+    to. Every request therefore starts with a random token that the daemon
+    reads from its stdin on startup, and requests without it are rejected.
+
+    All methods must be called from the thread of the event loop that runs the
+    scripts (see engine.EventLoopThread).
+    """
+    jvm_options = ('-Xmx1g', '-Xss2m', '-XX:+ExitOnOutOfMemoryError')
+    startup_timeout = 120  # s, includes compiling the host on first use
+    ping_timeout = 5  # s
+    cancel_grace_period = 2  # s
+    errors = 'replace'  # for decoding the output, which the daemon sends as UTF-8
+    restart = True  # after dying during an evaluation
+
+    def __init__(self):
+        self.process = None
+        self.port = None
+        self.token = None
+        self.directory = None
+        # created lazily so that they belong to the loop of the caller
+        self._lock = None  # guards process and port
+        self._run_lock = None  # one evaluation at a time
+        self._writer = None
+        self._owner = None
+        self._kill_handle = None
+        self._cancelled = weakref.WeakSet()  # owners cancelled before their request was sent
+        self._closing = False  # shut down on purpose, so not restarted
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._closing = False
+            if self.alive:
+                return self.port
+            await self._terminate()
+
+            kotlin_home = toolchain.find_kotlin_home()
+            if kotlin_home is None:
+                raise DaemonError(f"{toolchain.KOTLINC} not found. Please make sure it is in your PATH.")
+            try:
+                # may compile the host first, which takes a while
+                command = await asyncio.get_event_loop().run_in_executor(None, functools.partial(
+                    toolchain.host_command, kotlin_home, 'daemon', jvm_options=self.jvm_options
+                ))
+                self.directory = tempfile.mkdtemp(prefix='kotlin-workspace-daemon-')
+                self.process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                    cwd=self.directory,
+                    env=processes.owned_environment(),
+                    start_new_session=True
+                )
+            except toolchain.ToolchainError as e:
+                raise DaemonError(str(e))
+            except FileNotFoundError:
+                raise DaemonError(f"{toolchain.JAVA} not found. Please make sure it is in your PATH or set JAVA_HOME.")
+
+            # passed through stdin rather than the command line or the
+            # environment, which other users might be able to see
+            self.token = secrets.token_hex(16)
+            try:
+                self.process.stdin.write(f'{self.token}\n'.encode())
+                await self.process.stdin.drain()
+                self.process.stdin.close()
+                line = await asyncio.wait_for(self.process.stdout.readline(), self.startup_timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                line = b''
+            if not line.startswith(b'PORT '):
+                await self._terminate()
+                raise DaemonError("The Kotlin daemon failed to start.")
+            self.port = int(line.split()[1])
+            return self.port
+
+    def start_in_background(self):
+        async def _start():
+            try:
+                await self.start()
+            except DaemonError:
+                pass  # reported again on the next run
+
+        asyncio.ensure_future(_start())
+
+    async def ping(self):
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection('127.0.0.1', self.port), self.ping_timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        try:
+            writer.write(self._encode_request('ping'))
+            return await asyncio.wait_for(reader.readline(), self.ping_timeout) == b'pong\n'
+        except (OSError, asyncio.TimeoutError):
+            return False
+        finally:
+            writer.close()
+
+    async def shutdown(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self._closing = True
+        async with self._lock:
+            await self._terminate()
+
+    async def _terminate(self):
+        if self.process is not None:
+            self._kill(self.process)
+            await self.process.wait()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.process = None
+        self.port = None
+        self.token = None
+        self.directory = None
+
+    def _encode_request(self, *args):
+        return ('\t'.join((self.token, *args)) + '\n').encode()
+
+    @staticmethod
+    def _kill(process):
+        # including any processes that scripts started
+        processes.signal_group(process.pid, signal.SIGKILL)
+
+    async def run(self, script_path, emit, owner=None):
+        """
+        Evaluates the script in the daemon, passing its output to
+        emit(stream, chunk). Returns the exit code.
+
+        Requests wait for each other. The owner (e.g., an engine.ScriptRun) is
+        what cancel() must be called with; if it has been cancelled or its
+        stopped attribute is set by the time the request would be sent (e.g.,
+        while the daemon was starting), the request is skipped.
+        """
+        return await self._request(emit, owner, 'script', os.path.abspath(script_path))
+
+    async def compile(self, script_path, jar, emit, owner=None):
+        """
+        Compiles the script into the jar, passing diagnostics to
+        emit(stream, chunk). Returns the exit code of the compiler.
+        """
+        return await self._request(emit, owner, 'compile', os.path.abspath(script_path), os.path.abspath(jar))
+
+    async def run_compiled(self, jar, class_name, emit, owner=None):
+        return await self._request(emit, owner, 'run', os.path.abspath(jar), class_name)
+
+    async def _request(self, emit, owner, *args):
+        if self._run_lock is None:
+            self._run_lock = asyncio.Lock()
+        async with self._run_lock:
+            if self._is_cancelled(owner):
+                return 1
+            await self.start()
+            if not await self.ping():
+                # wedged, e.g. a previous script is still running after a cancel
+                await self.shutdown()
+                await self.start()
+            # the owner may have been stopped while the daemon was starting
+            if self._is_cancelled(owner):
+                return 1
+
+            process = self.process
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+            except OSError as e:
+                raise DaemonError(f"Could not connect to the Kotlin daemon: {e}")
+
+            self._writer = writer
+            self._owner = owner
+            try:
+                writer.write(self._encode_request(*args))
+                return await self._receive(reader, process, emit)
+            finally:
+                self._writer = None
+                self._owner = None
+                writer.close()
+                if self._kill_handle is not None:
+                    self._kill_handle.cancel()
+                    self._kill_handle = None
+
+    async def _receive(self, reader, process, emit):
+        # characters may be split between frames
+        decoders = {
+            b'o': ('stdout', codecs.getincrementaldecoder('utf-8')(self.errors)),
+            b'e': ('stderr', codecs.getincrementaldecoder('utf-8')(self.errors)),
+        }
+        while True:
+            try:
+                kind, length = struct.unpack('>cI', await reader.readexactly(5))
+                payload = await reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                # the daemon died during the evaluation
+                exit_code = await process.wait()
+                if self.restart and not self._closing:
+                    self.start_in_background()
+                return exit_code or 1
+
+            if kind == b'x':
+                for stream, decoder in decoders.values():
+                    chunk = decoder.decode(b'', final=True)
+                    if chunk:
+                        emit(stream, chunk)
+                return struct.unpack('>i', payload)[0]
+            stream, decoder = decoders[kind]
+            chunk = decoder.decode(payload)
+            if chunk:
+                emit(stream, chunk)
+
+    def _is_cancelled(self, owner):
+        if owner is None:
+            return False
+        if owner in self._cancelled:
+            self._cancelled.discard(owner)
+            return True
+        return getattr(owner, 'stopped', False)
+
+    def cancel(self, owner=None, interrupt=True):
+        """
+        Interrupts the running evaluation if it belongs to the owner (unless
+        interrupt is unset). If it does not finish within the grace period,
+        the daemon is killed (and restarted in the background unless restart
+        is unset). If the request of the owner has not been sent yet, it is
+        skipped.
+        """
+        writer = self._writer
+        if writer is None or owner is not self._owner:
+            if owner is not None:
+                self._cancelled.add(owner)
+            return
+        if writer.is_closing() or not interrupt:
+            return
+        writer.write(b'c')
+        process = self.process
+        if process is not None and self._kill_handle is None:
+            self._kill_handle = asyncio.get_event_loop().call_later(
+                self.cancel_grace_period, self._kill, process
+            )
@@ -0,0 +1,932 @@
+from array import array
+import asyncio
+import codecs
+from collections import deque, namedtuple
+import functools
+import math
+import os
+import re
+import shutil
+import tempfile
+from threading import Thread
+import time
+import signal
+import traceback
+
+import psutil
+
+import daemon
+import processes
+import toolchain
+
+
+SCRIPT_BASENAME = 'script'
+SCRIPT_EXT = 'kts'
+SCRIPT_NAME = f'{SCRIPT_BASENAME}.{SCRIPT_EXT}'
+
+READ_SIZE = 256 * 1024  # bytes, default for ScriptRun.read_size
+
+FILE_LOCATION_PATTERN = re.compile(
+    fr'{SCRIPT_BASENAME}(\.{SCRIPT_EXT})?:(?P<row>\d+)(?::(?P<col>\d+))?'
+)
+# a line of compiler output like "script.kts:1:5: error: unresolved reference"
+DIAGNOSTIC_PATTERN = re.compile(
+    fr'^(?:\S*?{FILE_LOCATION_PATTERN.pattern}: )?(?P<severity>error|warning|info): (?P<message>.*)$',
+    re.MULTILINE
+)
+
+# Preferred locations for run directories, the first writable one wins.
+# Falls back to the default temporary directory.
+RUN_DIRECTORY_ROOTS = ('/dev/shm',)
+
+
+def run_directory_root():
+    for root in RUN_DIRECTORY_ROOTS:
+        if os.path.isdir(root) and os.access(root, os.W_OK | os.X_OK):
+            return root
+    return None
+
+
+class Location(namedtuple('Location', ['start', 'end', 'row', 'col'])):
+    """
+    A location in the script (like script.kts:12:5) that was found at
+    text[start:end]. The col is 0 if the location does not mention one.
+    """
+    __slots__ = ()
+
+
+def find_locations(text):
+    return [
+        Location(match.start(), match.end(), int(match.group('row')), int(match.group('col') or 0))
+        for match in FILE_LOCATION_PATTERN.finditer(text)
+    ]
+
+
+class Diagnostic(namedtuple('Diagnostic', ['severity', 'row', 'col', 'message'])):
+    """
+    A message of the compiler with its severity ('error', 'warning' or
+    'info'). The row and col are 0 if the message does not mention them.
+    """
+    __slots__ = ()
+
+
+def parse_diagnostics(text):
+    return [
+        Diagnostic(
+            match.group('severity'), int(match.group('row') or 0), int(match.group('col') or 0),
+            match.group('message').rstrip('\r')
+        )
+        for match in DIAGNOSTIC_PATTERN.finditer(text)
+    ]
+
+
+class LocationScanner:
+    """
+    Finds locations in a stream of text that may split them between chunks.
+
+    Locations never contain whitespace, so feed() holds back the last word of
+    the text (which may be the beginning of a location) until more text or
+    flush() completes it. Words longer than max_pending are not held back.
+    """
+    max_pending = 1024  # chars
+
+    def __init__(self):
+        self.pending = ''
+
+    def feed(self, chunk):
+        """
+        Returns (text, locations) for the text that is ready or None.
+        """
+        text = self.pending + chunk
+        cut = max(text.rfind(whitespace) for whitespace in ' \t\n\r') + 1
+        if cut == 0:
+            if len(text) < self.max_pending:
+                self.pending = text
+                return None
+            cut = len(text)
+        self.pending = text[cut:]
+        text = text[:cut]
+        return text, find_locations(text)
+
+    def flush(self):
+        text = self.pending
+        self.pending = ''
+        if not text:
+            return None
+        return text, find_locations(text)
+
+
+class Output(namedtuple('Output', ['kind', 'chunk', 'locations'], defaults=((),))):
+    """
+    Text the script wrote to its 'stdout' or 'stderr'. For 'stderr', locations
+    lists the Locations in the chunk.
+    """
+    __slots__ = ()
+
+
+class CacheResult(namedtuple('CacheResult', ['kind', 'result'])):
+    """
+    Whether the compiled script was found in the cache ('hit' or 'miss').
+    """
+    __slots__ = ()
+
+    def __new__(cls, result):
+        return super().__new__(cls, 'cache', result)
+
+
+class Exit(namedtuple('Exit', ['kind', 'code', 'reason'])):
+    """
+    The last event of every run. The reason is None if the script exited on its
+    own and 'stopped', 'timeout', 'cpu' or 'memory' if it was ended by the
+    runner (see ScriptRun for the limits).
+    """
+    __slots__ = ()
+
+    def __new__(cls, code, reason=None):
+        return super().__new__(cls, 'exit', code, reason)
+
+
+class Queued(namedtuple('Queued', ['kind'])):
+    """
+    The run is waiting for the scheduler to let it start.
+    """
+    __slots__ = ()
+
+    def __new__(cls):
+        return super().__new__(cls, 'queued')
+
+
+class Started(namedtuple('Started', ['kind'])):
+    """
+    The run has left the queue of the scheduler.
+    """
+    __slots__ = ()
+
+    def __new__(cls):
+        return super().__new__(cls, 'started')
+
+
+class Scheduler:
+    """
+    Limits how many runs (and thus kotlinc/JVM processes) are active at the
+    same time. Unless max_processes is set, the limit follows the CPU count and
+    the memory that is currently available, but at least one run may always be
+    active. Runs that have been started within the last startup_period have
+    not allocated most of their memory yet, so memory_per_process is reserved
+    for each of them.
+
+    Must only be used from one event loop.
+    """
+    memory_per_process = 512 * 1024 * 1024  # bytes, a rough guess for kotlinc
+    startup_period = 10  # s until a run is assumed to use its memory
+    recheck_interval = 1  # s, since memory can be freed by other processes
+
+    def __init__(self, max_processes=None):
+        self.max_processes = max_processes
+        self.active = 0
+        self.waiting = 0
+        self._start_times = deque()  # time.monotonic() of the recent starts
+        self._condition = None  # created lazily to belong to the running loop
+
+    @property
+    def starting(self):
+        """
+        Number of active runs that are still within their startup_period.
+        """
+        now = time.monotonic()
+        while self._start_times and now - self._start_times[0] > self.startup_period:
+            self._start_times.popleft()
+        # runs may also have ended early
+        return min(self.active, len(self._start_times))
+
+    def capacity(self):
+        if self.max_processes is not None:
+            return max(1, self.max_processes)
+        available = psutil.virtual_memory().available - self.starting * self.memory_per_process
+        by_memory = self.active + max(0, available) // self.memory_per_process
+        return max(1, min(os.cpu_count() or 1, by_memory))
+
+    def can_start(self):
+        return self.active < self.capacity()
+
+    async def acquire(self, on_queued=None):
+        """
+        Waits for a free slot. Calls on_queued() once if that takes a while and
+        returns whether it did.
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        queued = False
+        async with self._condition:
+            self.waiting += 1
+            try:
+                while not self.can_start():
+                    if not queued:
+                        queued = True
+                        if on_queued is not None:
+                            on_queued()
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), self.recheck_interval)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self._start_times.append(time.monotonic())
+        return queued
+
+    async def release(self):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class UsageSample(namedtuple('UsageSample', [
+    'kind', 'time', 'cpu_percent', 'rss', 'threads', 'read_bytes', 'write_bytes'
+])):
+    """
+    A sample of the resource usage of the process tree of a run. The CPU usage
+    is summed over all cores (so it can exceed 100) and the I/O counters are
+    cumulative since the processes were started.
+    """
+    __slots__ = ()
+
+    def __new__(cls, time, cpu_percent, rss, threads, read_bytes, write_bytes):
+        return super().__new__(cls, 'usage', time, cpu_percent, rss, threads, read_bytes, write_bytes)
+
+
+class ResourceUsage:
+    """
+    Samples the CPU time, memory, threads and I/O of the process trees of a
+    run and keeps the samples as a time series in compact arrays.
+
+    Values are sampled every interval seconds, so the CPU time misses at most
+    the last interval of each process tree and short memory spikes may go
+    unnoticed. CPU time of processes that have been reaped by a parent in the
+    tree is included through the parent's children times.
+    """
+    interval = 0.1  # s
+
+    def __init__(self, on_sample=None):
+        self.on_sample = on_sample  # called with each UsageSample
+        self.cpu_seconds = 0.0
+        self.peak_rss = 0  # bytes, of the whole tree
+        self.times = array('d')  # time.monotonic()
+        self.cpu_percent = array('f')
+        self.rss = array('Q')  # bytes
+        self.threads = array('L')
+        self.read_bytes = array('Q')
+        self.write_bytes = array('Q')
+
+    async def track(self, pid, since_now=False):
+        """
+        Samples the tree below pid until cancelled. CPU times add up over
+        consecutive calls (e.g., for compiling and then running a script).
+        With since_now, the CPU time that the tree has used before (e.g., a
+        spare JVM while warming up) is not counted.
+        """
+        try:
+            root = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            return
+        base = self.cpu_seconds
+        if since_now:
+            measurement = self._measure(root)
+            if measurement is not None:
+                base -= measurement[0]
+        while True:
+            self._sample(root, base)
+            await asyncio.sleep(self.interval)
+
+    @staticmethod
+    def _measure(root):
+        """
+        Returns the (cpu, rss, threads, read_bytes, write_bytes) of the tree
+        below root, or None if root has exited.
+        """
+        try:
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return None
+        cpu = 0.0
+        rss = threads = read_bytes = write_bytes = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    cpu += times.user + times.system + times.children_user + times.children_system
+                    rss += process.memory_info().rss
+                    threads += process.num_threads()
+                    try:
+                        io = process.io_counters()
+                    except (psutil.AccessDenied, AttributeError):
+                        pass  # not available on all platforms
+                    else:
+                        read_bytes += io.read_bytes
+                        write_bytes += io.write_bytes
+            except psutil.NoSuchProcess:
+                pass
+        return cpu, rss, threads, read_bytes, write_bytes
+
+    def _sample(self, root, base):
+        now = time.monotonic()
+        measurement = self._measure(root)
+        if measurement is None:
+            return
+        cpu, rss, threads, read_bytes, write_bytes = measurement
+
+        previous_cpu_seconds = self.cpu_seconds
+        self.cpu_seconds = max(self.cpu_seconds, base + cpu)
+        self.peak_rss = max(self.peak_rss, rss)
+        if self.times and now > self.times[-1]:
+            cpu_percent = 100 * (self.cpu_seconds - previous_cpu_seconds) / (now - self.times[-1])
+        else:
+            cpu_percent = 0.0
+
+        sample = UsageSample(now, cpu_percent, rss, threads, read_bytes, write_bytes)
+        self.times.append(now)
+        self.cpu_percent.append(cpu_percent)
+        self.rss.append(rss)
+        self.threads.append(threads)
+        self.read_bytes.append(read_bytes)
+        self.write_bytes.append(write_bytes)
+        if self.on_sample is not None:
+            self.on_sample(sample)
+
+    def series(self):
+        """
+        Returns the samples as lists by field, e.g. for exporting them as JSON.
+        """
+        return {
+            'times': self.times.tolist(),
+            'cpu_percent': self.cpu_percent.tolist(),
+            'rss': self.rss.tolist(),
+            'threads': self.threads.tolist(),
+            'read_bytes': self.read_bytes.tolist(),
+            'write_bytes': self.write_bytes.tolist(),
+        }
+
+
+class ScriptRun:
+    """
+    A single execution of a script.
+
+    Iterating over a run (async for) starts the script and yields its events,
+    which are tuples like these:
+        Output('stdout', 'Hello, world!')  == ('stdout', 'Hello, world!', ())
+        Output('stderr', 'script.kts:1:1: error: foo', [Location(0, 14, 1, 1)]), the locations only with scan_locations
+        UsageSample(...)  == ('usage', time, cpu_percent, ...), only with measure_usage
+        Queued()  == ('queued',), only if the scheduler makes the run wait
+        Started()  == ('started',), only after Queued()
+        CacheResult('hit')  == ('cache', 'hit')
+        Exit(1)  == ('exit', 1, None)
+    The Exit event is always the last one. Abandoning the iteration early stops
+    the script.
+
+    With compile_only, the script is only compiled (into the cache, if there is
+    one) and the exit code is that of the compiler.
+
+    Speculative runs (e.g., compiles while the script is still being edited)
+    are stopped often. They take a spare from the pool even if there is a
+    daemon, since interrupting the compiler in the shared daemon may take so
+    long that it is killed and restarted cold. If they do use the daemon,
+    stopping them only skips their request if it has not been sent yet, and a
+    compile that succeeds anyway is kept in the cache.
+
+    Without a daemon, a run takes a spare JVM from the pool if there is one
+    (see pool.SparePool). Like the daemon, spares run the script in a scratch
+    directory of their own.
+
+    The time.monotonic() of the phases of the run (start, spawn, compiled,
+    first_stdout, first_stderr, exit) is recorded in timings, see timings.py.
+
+    The limits of a run are enforced by the runner: timeout (s of wall-clock
+    time), cpu_limit (s of CPU time) and memory_limit (bytes of RSS) of the
+    process tree. The CPU limit is also set as RLIMIT_CPU and the JVM heap is
+    capped below the memory limit, so that scripts usually fail with an
+    OutOfMemoryError first. The warm JVM is shared by all runs, so runs with
+    a CPU or memory limit do not use it. Spares are single-use, so the limits
+    are enforced on them like on processes of the run's own (except for the
+    heap size, which is fixed when the spare starts).
+
+    Processes of a run get a process group (and session) of their own. Stopping
+    the run sends SIGTERM to the group and SIGKILL after stop_grace_period.
+    Processes that are left in the group when the run ends (e.g., ones that
+    the script started in the background) are killed as well.
+
+    KOTLINC processes use the class data archive if one is given and present
+    (see cds.ClassDataArchive), otherwise it is created in the background for
+    later runs.
+
+    Every run gets a fresh directory (preferably on tmpfs) that holds the
+    script, serves as working directory of the script and is deleted
+    afterwards, so any number of runs can share one event loop. stop() must be
+    called from the thread of that loop.
+    """
+    flush_delay = 0.05  # s until a held back word of stderr is emitted anyway
+    stop_grace_period = 1  # s between SIGTERM and SIGKILL
+    drain_timeout = 1  # s to read the pipes after the process has exited
+    exit_poll_interval = 0.1  # s
+
+    def __init__(self, script, daemon=None, cache=None, scheduler=None, timeout=None, measure_usage=False,
+                 encoding='utf-8', errors='replace', read_size=READ_SIZE, compile_only=False, pool=None, cds=None,
+                 cpu_limit=None, memory_limit=None, scan_locations=True, speculative=False):
+        self.script = script
+        self.daemon = daemon
+        self.pool = pool
+        self.cds = cds
+        self.cache = cache
+        self.scheduler = scheduler
+        self.compile_only = compile_only
+        self.speculative = speculative
+        self.timeout = timeout  # s
+        self.cpu_limit = cpu_limit  # s
+        self.memory_limit = memory_limit  # bytes
+        # of the output of processes, see codecs for the error policies
+        self.encoding = encoding
+        self.errors = errors
+        self.read_size = read_size  # bytes
+        # whether to find the Locations in stderr, which holds back its last
+        # word for up to flush_delay
+        self.scan_locations = scan_locations
+        self.measure_usage = measure_usage
+        # the limits are enforced through the samples
+        if measure_usage or cpu_limit is not None or memory_limit is not None:
+            self.usage = ResourceUsage(self._on_usage)
+        else:
+            self.usage = None
+        self.start_time = None
+        self.end_time = None
+        self.first_output_time = None
+        self.timings = {}  # phase -> time.monotonic()
+        self.directory = None
+        self.script_path = None
+        self.process = None
+        self.stopped = False
+        self.stop_reason = None
+        self.exit = None
+        self._events = None
+        self._waiting = None
+        self._location_scanner = LocationScanner()
+        self._flush_handle = None
+        self._kill_handle = None
+        self._spare = None
+
+    async def __aiter__(self):
+        self._events = asyncio.Queue()
+        task = asyncio.ensure_future(self._run_guarded())
+        try:
+            while True:
+                event = await self._events.get()
+                yield event
+                if event.kind == 'exit':
+                    return
+        finally:
+            if not task.done():
+                self.stop()
+
+    @property
+    def wall_seconds(self):
+        """
+        Time between leaving the queue and exiting, or None.
+        """
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    @property
+    def first_output_seconds(self):
+        """
+        Time between leaving the queue and the first output, or None.
+        """
+        if self.start_time is None or self.first_output_time is None:
+            return None
+        return self.first_output_time - self.start_time
+
+    @property
+    def stop_seconds(self):
+        """
+        Time between stop() and the exit, or None.
+        """
+        if 'stop' not in self.timings or 'exit' not in self.timings:
+            return None
+        return self.timings['exit'] - self.timings['stop']
+
+    def mark(self, phase):
+        """
+        Records the current time for the phase unless it has been reached
+        before.
+        """
+        if phase not in self.timings:
+            self.timings[phase] = time.monotonic()
+
+    def _emit(self, event):
+        self._events.put_nowait(event)
+
+    def _on_usage(self, sample):
+        if self.memory_limit is not None and sample.rss > self.memory_limit:
+            self.stop('memory')
+        elif self.cpu_limit is not None and self.usage.cpu_seconds > self.cpu_limit:
+            self.stop('cpu')
+        if self.measure_usage:
+            self._emit(sample)
+
+    def _emit_output(self, stream, chunk):
+        if self.first_output_time is None:
+            self.first_output_time = time.monotonic()
+        self.mark(f'first_{stream}')
+        if stream != 'stderr' or not self.scan_locations:
+            self._emit(Output(stream, chunk))
+            return
+
+        scanned = self._location_scanner.feed(chunk)
+        if scanned is not None:
+            self._emit(Output('stderr', *scanned))
+        # do not hold back the last word if nothing follows soon
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._location_scanner.pending:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.flush_delay, self._flush_stderr)
+
+    def _flush_stderr(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        scanned = self._location_scanner.flush()
+        if scanned is not None:
+            self._emit(Output('stderr', *scanned))
+
+    async def _run_guarded(self):
+        # The iteration only ends with the Exit event, so it must be emitted
+        # even if something fails outside of the script's own error handling.
+        try:
+            await self._run()
+        except Exception:
+            if self.exit is not None:
+                raise
+            self._emit_output('stderr', traceback.format_exc())
+            self._finish(1)
+
+    async def _run(self):
+        if self.scheduler is None:
+            return await self._run_in_directory()
+
+        self._waiting = asyncio.ensure_future(self.scheduler.acquire(lambda: self._emit(Queued())))
+        try:
+            queued = await self._waiting
+        except asyncio.CancelledError:
+            if not self.stopped:
+                raise
+            self.exit = Exit(1, self.stop_reason)
+            self._emit(self.exit)
+            return
+        finally:
+            self._waiting = None
+        if queued:
+            self._emit(Started())
+
+        try:
+            await self._run_in_directory()
+        finally:
+            await self.scheduler.release()
+
+    async def _run_in_directory(self):
+        self.start_time = time.monotonic()
+        self.mark('start')
+        timer = None
+        try:
+            if self.timeout is not None:
+                timer = asyncio.get_event_loop().call_later(self.timeout, self.stop, 'timeout')
+            self.directory = tempfile.mkdtemp(prefix='kotlin-workspace-', dir=run_directory_root())
+            self.script_path = os.path.join(self.directory, SCRIPT_NAME)
+            with open(self.script_path, "w") as f:
+                f.write(self.script)
+            exit_code = await self._run_script()
+        except Exception:
+            self._emit_output('stderr', traceback.format_exc())
+            exit_code = 1
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+        self._finish(exit_code)
+
+    def _finish(self, exit_code):
+        self._flush_stderr()
+        self.end_time = time.monotonic()
+        self.mark('exit')
+        self.exit = Exit(exit_code, self.stop_reason)
+        self._emit(self.exit)
+
+    @property
+    def limited(self):
+        return self.cpu_limit is not None or self.memory_limit is not None
+
+    async def _run_script(self):
+        if self.limited and self.daemon is not self._spare:
+            # the shared JVM cannot be limited without affecting other runs
+            self.daemon = None
+        if (self.daemon is None or self.speculative) and self.pool is not None and self._spare is None:
+            self._waiting = asyncio.ensure_future(self.pool.take())
+            try:
+                spare = await self._waiting
+            except asyncio.CancelledError:
+                if not self.stopped:
+                    raise
+                return 1
+            finally:
+                self._waiting = None
+            if spare is not None:
+                self.daemon = spare
+                self._spare = spare
+                monitor = None
+                if self.usage is not None:
+                    monitor = asyncio.ensure_future(self.usage.track(spare.process.pid, since_now=True))
+                if self.cpu_limit is not None:
+                    self._limit_cpu(spare.process.pid)
+                try:
+                    exit_code = await self._run_script()
+                    if exit_code == -signal.SIGXCPU:
+                        self.stop('cpu')
+                    return exit_code
+                finally:
+                    if monitor is not None:
+                        monitor.cancel()
+                    self.daemon = None
+                    self._spare = None
+                    asyncio.ensure_future(spare.shutdown())
+
+        if self.daemon is not None:
+            try:
+                if self.cache is not None:
+                    return await self._run_cached()
+                if self.compile_only:
+                    return await self._compile(self._scratch_jar())
+                self.mark('spawn')
+                return await self.daemon.run(self.script_path, self._emit_output, owner=self)
+            except daemon.DaemonError as e:
+                self._emit_output('stderr', f"Warm JVM unavailable, falling back to {toolchain.KOTLINC}: {e}\n")
+                self.daemon = None
+
+        if self.cache is not None:
+            try:
+                return await self._run_cached()
+            except toolchain.ToolchainError as e:
+                self._emit_output('stderr', f"Script cache unavailable: {e}\n")
+
+        if self.compile_only:
+            return await self._compile(self._scratch_jar())
+        return await self._run_process(
+            [toolchain.KOTLINC, '-script', SCRIPT_NAME], environment=self._kotlinc_environment()
+        )
+
+    async def _run_cached(self):
+        kotlin_home = toolchain.find_kotlin_home()
+        if kotlin_home is None:
+            raise toolchain.ToolchainError(f"{toolchain.KOTLINC} not found. Please make sure it is in your PATH.")
+
+        if self.daemon is not None:
+            jvm_options = self.daemon.jvm_options
+        else:
+            jvm_options = tuple(os.environ.get('JAVA_OPTS', '').split())
+        key = self.cache.key(self.script, toolchain.kotlin_version(kotlin_home), jvm_options)
+        # e.g. a speculative compile of the same script, whose result is as
+        # good as ours
+        while key in self.cache.compiling:
+            self._waiting = asyncio.ensure_future(asyncio.wait([self.cache.compiling[key]]))
+            try:
+                await self._waiting
+            except asyncio.CancelledError:
+                if not self.stopped:
+                    raise
+                return 1
+            finally:
+                self._waiting = None
+        jar = self.cache.get(key)
+        self._emit(CacheResult('hit' if jar is not None else 'miss'))
+
+        if jar is None:
+            partial = self.cache.partial_jar(key)
+            compiling = self.cache.compiling[key] = asyncio.get_event_loop().create_future()
+            start = time.monotonic()
+            try:
+                exit_code = await self._compile(partial)
+            finally:
+                del self.cache.compiling[key]
+                compiling.set_result(None)
+            # a speculative compile is only stopped if it has not started or
+            # can be interrupted, otherwise its result is as good as any
+            if exit_code != 0 or self.stopped and not self.speculative:
+                try:
+                    os.remove(partial)
+                except FileNotFoundError:
+                    pass
+                return exit_code
+            jar = self.cache.put(key, partial, time.monotonic() - start)
+
+        self.mark('compiled')
+        if self.compile_only:
+            return 0
+        class_name = SCRIPT_BASENAME.capitalize()
+        if self.daemon is not None:
+            self.mark('spawn')
+            return await self.daemon.run_compiled(jar, class_name, self._emit_output, owner=self)
+        # may compile the host first, which takes a while
+        command = await asyncio.get_event_loop().run_in_executor(None, functools.partial(
+            toolchain.host_command, kotlin_home, 'run', jar, class_name, jvm_options=self._jvm_options()
+        ))
+        return await self._run_process(command)
+
+    async def _compile(self, jar):
+        if self.daemon is not None:
+            self.mark('spawn')
+            exit_code = await self.daemon.compile(self.script_path, jar, self._emit_output, owner=self)
+        else:
+            exit_code = await self._run_process(
+                [toolchain.KOTLINC, '-Xallow-any-scripts-in-source-roots', SCRIPT_NAME, '-d', jar],
+                environment=self._kotlinc_environment()
+            )
+        if exit_code == 0:
+            self.mark('compiled')
+        return exit_code
+
+    def _scratch_jar(self):
+        # deleted along with the directory
+        return os.path.join(self.directory, f'{SCRIPT_BASENAME}.jar')
+
+    def _jvm_options(self):
+        if self.memory_limit is None:
+            return []
+        # leave room for the rest of the JVM
+        return [f'-Xmx{max(16, self.memory_limit * 3 // 4 // 2**20)}m']
+
+    def _kotlinc_environment(self):
+        options = self._jvm_options()
+        if self.cds is not None:
+            cds_options = self.cds.java_options()
+            if not cds_options and self.cds.error is None:
+                # not retried after failures, which need a newer JDK or a fix
+                self.cds.create_in_background()
+            options += cds_options
+        if not options:
+            return None
+        return dict(os.environ, JAVA_OPTS=' '.join([os.environ.get('JAVA_OPTS', ''), *options]).strip())
+
+    async def _run_process(self, command, environment=None):
+        if self.stopped:
+            return 1
+
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self.directory,
+                env=processes.owned_environment(environment),
+                # let the pipes buffer whole reads before pausing
+                limit=self.read_size,
+                start_new_session=True
+            )
+        except FileNotFoundError:
+            self._emit_output('stderr', f"{command[0]} not found. Please make sure it is in your PATH.")
+            return 127
+        self.mark('spawn')
+        if self.stopped:
+            # while spawning
+            self._terminate()
+        if self.cpu_limit is not None:
+            self._limit_cpu(self.process.pid)
+
+        monitor = None
+        if self.usage is not None:
+            monitor = asyncio.ensure_future(self.usage.track(self.process.pid))
+        pumps = asyncio.gather(
+            self._pump(self.process.stdout, 'stdout'),
+            self._pump(self.process.stderr, 'stderr')
+        )
+        exited = asyncio.ensure_future(self._wait_for_exit())
+        try:
+            # keep reading until both streams have been closed
+            done, _ = await asyncio.wait([pumps, exited], return_when=asyncio.FIRST_COMPLETED)
+            if pumps in done:
+                exit_code = await self.process.wait()
+            else:
+                # processes that the script started in the background may keep
+                # the pipes open
+                done, _ = await asyncio.wait([pumps], timeout=self.drain_timeout)
+                if not done:
+                    processes.signal_group(self.process.pid, signal.SIGKILL)
+                    await asyncio.wait([pumps], timeout=self.drain_timeout)
+                exit_code = self.process.returncode
+            if exit_code == -signal.SIGXCPU:
+                self.stop('cpu')
+            return exit_code
+        finally:
+            pumps.cancel()
+            exited.cancel()
+            if monitor is not None:
+                monitor.cancel()
+            processes.signal_group(self.process.pid, signal.SIGKILL)
+            if self._kill_handle is not None:
+                self._kill_handle.cancel()
+                self._kill_handle = None
+
+    async def _wait_for_exit(self):
+        # Process.wait() also waits for the pipes to be closed
+        while self.process.returncode is None:
+            await asyncio.sleep(self.exit_poll_interval)
+
+    def _limit_cpu(self, pid):
+        # A backstop for the samples, which the kernel enforces for each
+        # process of the tree on its own. Slightly above the limit so that the
+        # samples usually catch it first. The process may have used CPU time
+        # before the run (a spare), which counts towards RLIMIT_CPU as well.
+        if not hasattr(psutil, 'RLIMIT_CPU'):
+            return
+        try:
+            process = psutil.Process(pid)
+            times = process.cpu_times()
+            used = times.user + times.system
+            seconds = math.ceil(used + max(0, self.cpu_limit - self.usage.cpu_seconds)) + 1
+            process.rlimit(psutil.RLIMIT_CPU, (seconds, seconds + 1))
+        except (psutil.Error, OSError):
+            pass
+
+    async def _pump(self, stream, kind):
+        # characters may be split between reads
+        decoder = codecs.getincrementaldecoder(self.encoding)(self.errors)
+        while True:
+            data = await stream.read(self.read_size)
+            chunk = decoder.decode(data, final=not data)
+            if chunk:
+                self._emit_output(kind, chunk)
+            if not data:
+                return
+
+    def stop(self, reason='stopped'):
+        if self.stopped:
+            return
+        self.stopped = True
+        self.stop_reason = reason
+        self.mark('stop')
+
+        if self._waiting is not None:
+            self._waiting.cancel()
+            return
+
+        if self.daemon is not None:
+            if self.stop_reason == 'memory' and self.daemon is self._spare:
+                # no time to grow any further, and the spare is discarded anyway
+                processes.signal_group(self._spare.process.pid, signal.SIGKILL)
+                return
+            # only spares are interrupted during speculative runs
+            self.daemon.cancel(owner=self, interrupt=not self.speculative or self.daemon is self._spare)
+            return
+
+        # If the process is still being spawned, _run_process() terminates it.
+        # If it has exited already, processes that it started in the
+        # background may still be running.
+        if self.process is None or self.exit is not None:
+            return
+        self._terminate()
+
+    def _terminate(self):
+        # The whole group, because kotlinc spawns a java process but doesn't
+        # pass on the signals it receives.
+        pid = self.process.pid
+        if self.stop_reason == 'memory':
+            # no time to grow any further
+            processes.signal_group(pid, signal.SIGKILL)
+            return
+        processes.signal_group(pid, signal.SIGTERM)
+        self._kill_handle = asyncio.get_event_loop().call_later(
+            self.stop_grace_period, processes.signal_group, pid, signal.SIGKILL
+        )
+
+
+class EventLoopThread(Thread):
+    """
+    Runs an asyncio event loop in a background thread so that synchronous code
+    (like the Tk UI) can start and stop runs. All runs share this one thread.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """
+        Schedules the coroutine on the loop and returns a
+        concurrent.futures.Future for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
@@ -0,0 +1,238 @@
+from array import array
+import re
+
+import stacktraces
+
+
+NUMBER_PATTERN = re.compile(r'\d+')
+
+
+def split_lines(segments):
+    """
+    Splits [(style, text)] into lines, which are lists of segments that end
+    with a line break (except for an unterminated last line). Yields each
+    line with its key, which is the same for lines that only differ in their
+    numbers, and whether it might be part of a stack trace.
+    """
+    line = []
+    key = []
+    trace = False
+    for style, text in segments:
+        # handling all lines of a segment at once is much faster
+        parts = text.split('\n')
+        key_parts = NUMBER_PATTERN.sub('0', text).split('\n')
+        segment_trace = stacktraces.might_contain(text)
+        for part, key_part in zip(parts[:-1], key_parts):
+            line.append((style, part + '\n'))
+            key.append((style, key_part))
+            yield line, tuple(key), trace or segment_trace
+            line = []
+            key = []
+            trace = False
+        if parts[-1]:
+            line.append((style, parts[-1]))
+            key.append((style, key_parts[-1]))
+            trace = trace or segment_trace
+    if line:
+        yield line, tuple(key), trace
+
+
+class LineFolder:
+    """
+    Folds output lines into the line shown before them:
+
+    - runs of consecutive lines that are identical, or that only differ in
+      their numbers
+    - frames of JVM stack traces that are not in the user's script, and
+      elided frames, so that the frames in the script stand out
+    - stack traces that repeat the stack trace right before them
+
+    feed() takes the completed lines of a terminal.Terminal as they come in
+    and returns what to show of them as a list of items:
+
+    - ('text', segments, line_numbers): lines to append, with the line numbers
+      (in the spool) of each of them
+    - ('label', line_number, label): the label that tells what has been folded
+      into the given line, which is the last line shown so far
+
+    Lines that might repeat the previous stack trace are held back until it is
+    clear whether they do. flush() releases them once no more lines follow.
+    The folded lines follow the line that they are folded into, runs keeps
+    their number for expand().
+    """
+    def __init__(self, first_line=0):
+        self.line_number = first_line  # of the next line
+        self.runs = {}  # line number -> number of lines folded into it plus one
+        self._compacted = set()  # line numbers of runs that are not just repeated lines
+        self._items = []
+        self._text_item = None  # the last item if it is a text item
+
+        # the last line shown and what has been folded into it
+        self._anchor = None
+        self._key = None  # of the lines that it can be repeated by, if any
+        self._repeats = 0
+        self._frames = 0
+        self._traces = 0
+        self._other = 0  # lines that are left over from expand()
+        self._label_changed = False
+
+        self._trace = None  # exact lines of the current stack trace
+        self._previous_trace = None  # right before the current one
+        self._candidate = None  # held back lines that repeat _previous_trace so far
+
+    def feed(self, segments):
+        for line, key, trace in split_lines(segments):
+            self._add(line, key, self.line_number, trace)
+            self.line_number += 1
+        return self._take_items()
+
+    def flush(self):
+        if self._candidate is not None:
+            self._resolve_candidate(complete=True)
+        return self._take_items()
+
+    def expand(self, line_number, limit):
+        """
+        Unfolds up to limit lines of the run that starts at the given line.
+        Returns how many lines have been unfolded and the label of the rest of
+        the run, which is folded into the last unfolded line, or None if
+        nothing is left.
+        """
+        count = self.runs.pop(line_number)
+        if line_number == self._anchor:
+            compacted = bool(self._frames or self._traces or self._other)
+        else:
+            compacted = line_number in self._compacted
+            self._compacted.discard(line_number)
+        unfolded = min(count - 1, limit)
+        rest = count - unfolded
+        anchor = line_number + unfolded
+        if rest > 1:
+            self.runs[anchor] = rest
+            if compacted:
+                self._compacted.add(anchor)
+        if self._anchor == line_number:
+            self._anchor = anchor
+            if compacted:
+                self._key = None
+                self._repeats = self._frames = self._traces = 0
+                self._other = rest - 1
+            else:
+                self._repeats = rest - 1
+            return unfolded, self._label()
+        if rest == 1:
+            return unfolded, None
+        return unfolded, self._format_label(0, 0, 0, rest - 1) if compacted else f' ×{rest}'
+
+    def _take_items(self):
+        if self._label_changed:
+            self._items.append(('label', self._anchor, self._label()))
+            self._label_changed = False
+        self._text_item = None
+        items = [
+            ('text', [(style, ''.join(parts)) for style, parts in item[1]], item[2]) if item[0] == 'text' else item
+            for item in self._items
+        ]
+        self._items = []
+        return items
+
+    def _add(self, line, key, line_number, trace):
+        exact = None
+        kind = None
+        if trace:
+            kind = stacktraces.classify(line[0][1] if len(line) == 1 else ''.join(text for style, text in line))
+        if self._candidate is not None:
+            exact = tuple(line)
+            position = len(self._candidate)
+            if position < len(self._previous_trace) and exact == self._previous_trace[position]:
+                self._candidate.append((line, key, line_number, exact, kind))
+                return
+            self._resolve_candidate(complete=kind in (None, 'header'))
+        self._process(line, key, line_number, exact, kind)
+
+    def _resolve_candidate(self, complete):
+        candidate, self._candidate = self._candidate, None
+        if complete and len(candidate) == len(self._previous_trace):
+            # fold the repeated stack trace, which counts as the current one
+            self._fold(len(candidate))
+            self._traces += 1
+            self._trace = self._previous_trace
+            self._key = None
+            return
+        self._process(*candidate[0], repeatable=False)
+        for entry in candidate[1:]:
+            self._process(*entry)
+
+    def _process(self, line, key, line_number, exact, kind, repeatable=True):
+        if kind is not None and exact is None:
+            exact = tuple(line)
+        if kind in (None, 'header'):
+            # a stack trace (if any) ends before the line
+            self._previous_trace = self._trace if kind == 'header' else None
+            self._trace = None
+            if repeatable and kind == 'header' and self._previous_trace is not None \
+                    and exact == self._previous_trace[0]:
+                self._candidate = [(line, key, line_number, exact, kind)]
+                return
+        if kind is not None:
+            if self._trace is None:
+                self._trace = []
+            self._trace.append(exact)
+            key = exact  # frames in different lines must not be folded together
+
+        if self._anchor is not None:
+            if kind in ('frame', 'elided'):
+                self._fold(1)
+                self._frames += 1
+                self._key = None
+                return
+            if key == self._key:
+                self._fold(1)
+                self._repeats += 1
+                return
+        self._show(line, key, line_number)
+
+    def _fold(self, count):
+        self.runs[self._anchor] = self.runs.get(self._anchor, 1) + count
+        self._label_changed = True
+
+    def _show(self, line, key, line_number):
+        if self._label_changed:
+            self._items.append(('label', self._anchor, self._label()))
+            self._label_changed = False
+            self._text_item = None
+        if self._frames or self._traces or self._other:
+            self._compacted.add(self._anchor)
+            self._frames = self._traces = self._other = 0
+        self._anchor = line_number
+        self._key = key
+        self._repeats = 0
+
+        if self._text_item is None:
+            self._text_item = ('text', [], array('Q'))
+            self._items.append(self._text_item)
+        _, segments, line_numbers = self._text_item
+        for style, text in line:
+            if segments and segments[-1][0] == style:
+                segments[-1][1].append(text)
+            else:
+                segments.append((style, [text]))
+        line_numbers.append(line_number)
+
+    def _label(self):
+        if not (self._frames or self._traces or self._other):
+            return f' ×{self._repeats + 1}' if self._repeats else None
+        return self._format_label(self._repeats, self._frames, self._traces, self._other)
+
+    @staticmethod
+    def _format_label(repeats, frames, traces, other):
+        parts = []
+        if repeats:
+            parts.append(f'×{repeats + 1}')
+        if frames:
+            parts.append(f"+{frames} {'frame' if frames == 1 else 'frames'}")
+        if traces:
+            parts.append(f'trace ×{traces + 1}')
+        if other:
+            parts.append(f"+{other} {'line' if other == 1 else 'lines'}")
+        return f" [{', '.join(parts)}]"
@@ -0,0 +1,104 @@
+import asyncio
+
+import psutil
+
+import daemon
+
+
+class SparePool:
+    """
+    Keeps up to size warm JVMs (see daemon.ScriptDaemon) waiting for a script.
+    Unlike the shared daemon, each spare evaluates a single script and is then
+    discarded, so runs do not share any state but still skip most of the JVM
+    and compiler startup. Taking a spare starts its replacement right away.
+
+    Spares are only started while more than min_available_memory would remain
+    available, counting memory_per_spare for each spare that is still starting
+    (and has not allocated its memory yet). They are shut down if they have not
+    been taken within idle_timeout. The pool then stays empty until the next
+    take().
+
+    All methods must be called from the thread of the event loop that runs the
+    scripts (see engine.EventLoopThread).
+    """
+    memory_per_spare = 512 * 1024 * 1024  # bytes, estimate for an idle compiler JVM
+    min_available_memory = 1024 * 1024 * 1024  # bytes
+    idle_timeout = 300  # s
+
+    def __init__(self, size=1):
+        self.size = size
+        self.spares = []  # oldest first
+        self._starts = {}  # spare -> task
+        self._idle_handles = {}  # spare -> handle
+
+    def memory_available(self):
+        starting = sum(not start.done() for start in self._starts.values())
+        available = psutil.virtual_memory().available - starting * self.memory_per_spare
+        return available - self.memory_per_spare >= self.min_available_memory
+
+    def fill(self):
+        """
+        Starts spares in the background until there are size of them.
+        """
+        while len(self.spares) < self.size and self.memory_available():
+            spare = daemon.ScriptDaemon()
+            # discarded after its run anyway
+            spare.restart = False
+            self.spares.append(spare)
+            self._starts[spare] = asyncio.ensure_future(spare.start())
+            self._idle_handles[spare] = asyncio.get_event_loop().call_later(
+                self.idle_timeout, self._retire, spare
+            )
+
+    def resize(self, size):
+        self.size = size
+        while len(self.spares) > self.size:
+            self._retire(self.spares[-1])
+        self.fill()
+
+    async def take(self):
+        """
+        Returns a started spare, which the caller must shut down when done,
+        or None if no spare could be started.
+        """
+        if not self.spares:
+            self.fill()
+            return None
+
+        spare = self.spares.pop(0)
+        start = self._starts.pop(spare)
+        self._idle_handles.pop(spare).cancel()
+        self.fill()
+        try:
+            # a spare that is still starting is closer to ready than a new process
+            await start
+        except daemon.DaemonError:
+            return None
+        except BaseException:
+            asyncio.ensure_future(spare.shutdown())
+            raise
+        return spare if spare.alive else None
+
+    def _retire(self, spare):
+        self.spares.remove(spare)
+        self._idle_handles.pop(spare).cancel()
+        start = self._starts.pop(spare)
+
+        async def _shutdown():
+            try:
+                await start
+            except daemon.DaemonError:
+                pass
+            await spare.shutdown()
+
+        asyncio.ensure_future(_shutdown())
+
+    async def shutdown(self):
+        spares = list(self.spares)
+        starts = [self._starts[spare] for spare in spares]
+        for spare in spares:
+            self.spares.remove(spare)
+            self._idle_handles.pop(spare).cancel()
+            self._starts.pop(spare)
+        await asyncio.gather(*starts, return_exceptions=True)
+        await asyncio.gather(*(spare.shutdown() for spare in spares))
@@ -0,0 +1,77 @@
+import os
+
+import psutil
+
+
+# Set in the environment of all processes that the workspace starts, with the
+# pid and start time of the workspace, so that they can be told apart from
+# other processes once the workspace is gone.
+OWNER_VARIABLE = 'KOTLIN_WORKSPACE_OWNER'
+
+
+def _owner_id(process):
+    return f'{process.pid}:{process.create_time()}'
+
+
+def owned_environment(environment=None):
+    """
+    Returns the environment (by default that of this process) for a child
+    process, marked as owned by this process.
+    """
+    return dict(os.environ if environment is None else environment, **{
+        OWNER_VARIABLE: _owner_id(psutil.Process())
+    })
+
+
+def signal_group(pid, signal_number):
+    """
+    Sends the signal to the process group led by pid (see start_new_session
+    in subprocess). Returns whether the group still existed.
+    """
+    try:
+        os.killpg(pid, signal_number)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the pid has been reused by a process of another user
+        return False
+    return True
+
+
+def find_orphans():
+    """
+    Returns the processes that were started by a workspace that is not
+    running anymore.
+    """
+    alive = {}
+    orphans = []
+    for process in psutil.process_iter():
+        try:
+            owner = process.environ().get(OWNER_VARIABLE)
+        except (psutil.AccessDenied, psutil.NoSuchProcess, psutil.ZombieProcess):
+            continue
+        if owner is None:
+            continue
+        if owner not in alive:
+            pid = int(owner.split(':')[0])
+            try:
+                alive[owner] = _owner_id(psutil.Process(pid)) == owner
+            except psutil.NoSuchProcess:
+                alive[owner] = False
+        if not alive[owner]:
+            orphans.append(process)
+    return orphans
+
+
+def reap_orphans():
+    """
+    Kills the processes left behind by workspaces that crashed. Returns how
+    many there were.
+    """
+    orphans = find_orphans()
+    for process in orphans:
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+    return len(orphans)
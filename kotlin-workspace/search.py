@@ -0,0 +1,226 @@
+from bisect import bisect_left
+import re
+
+
+# overlapping, so findall() finds all of them
+TRIGRAM_PATTERN = re.compile(r'(?=(\S\S\S))')
+# the index does not tell digits apart, so that lines that only differ in
+# their numbers count as the same
+DIGITS = str.maketrans('123456789', '000000000')
+# characters after an escape that the escaped character consists of
+ESCAPE_ARGUMENT_LENGTHS = {'x': 2, 'u': 4, 'U': 8}
+
+
+def normalize(text):
+    return text.lower().translate(DIGITS)
+
+
+def trigrams(text):
+    """
+    Returns the set of trigrams of the words (separated by whitespace) of the
+    text. Leaving out the trigrams across words means that only the distinct
+    words have to be taken apart, which are much fewer than the lines.
+    """
+    return set(TRIGRAM_PATTERN.findall(' '.join(set(text.split()))))
+
+
+def required_literals(pattern):
+    """
+    Returns strings that every match of the regular expression contains, as
+    far as that is easy to tell, or [] if it is not.
+    """
+    if '|' in pattern or '(?' in pattern:
+        return []
+    literals = []
+    current = []
+    depth = 0  # of groups, which might be optional
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        index += 1
+        in_group = depth > 0
+        if char == '\\':
+            escaped = pattern[index:index + 1]
+            index += 1
+            if escaped in ('n', 't'):
+                current.append({'n': '\n', 't': '\t'}[escaped])
+                continue
+            if escaped and not escaped.isalnum():
+                current.append(escaped)
+                continue
+            # a character class, anchor, back reference or a character given
+            # by its code or name, skip its arguments
+            if escaped in ESCAPE_ARGUMENT_LENGTHS:
+                index += ESCAPE_ARGUMENT_LENGTHS[escaped]
+            elif escaped == 'N' and pattern[index:index + 1] == '{':
+                index = pattern.find('}', index) + 1 or len(pattern)
+            elif escaped.isdigit():
+                # up to three digits in total
+                for _ in range(2):
+                    if pattern[index:index + 1].isdigit():
+                        index += 1
+        elif char in '*?{':
+            # the character before is optional
+            if current:
+                current.pop()
+            if char == '{':
+                index = pattern.find('}', index) + 1 or len(pattern)
+        elif char == '[':
+            # skip the set, which may start with ] and contain escapes
+            if pattern[index:index + 1] == '^':
+                index += 1
+            if pattern[index:index + 1] == ']':
+                index += 1
+            while index < len(pattern) and pattern[index] != ']':
+                index += 2 if pattern[index] == '\\' else 1
+            index += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char not in '+.^$':
+            current.append(char)
+            continue
+        if not in_group:
+            literals.append(''.join(current))
+        current = []
+    if depth == 0:
+        literals.append(''.join(current))
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+class OutputIndex:
+    """
+    Index for searching the output in a spool.OutputSpool.
+
+    The output is split into blocks of complete lines of about block_size
+    chars, and postings maps each trigram of the (normalized) words of the
+    output to the blocks that contain it, as a bitset of their numbers. A
+    search only has to scan the blocks that contain all trigrams of the
+    literal parts of the query together with the next block (as matches may
+    span lines), and the lines after the last block. The index
+    grows with the number of distinct trigrams and of blocks rather than with
+    the size of the output.
+
+    add() takes the output as it is appended to the spool and may be called
+    from another thread than search() (like the event loop thread of the
+    runner), so the index never holds up the UI. Lines that have been added
+    but not been appended to the spool yet are not searched.
+    """
+    block_size = 64 * 1024  # chars
+    scan_size = 256 * 1024  # bytes that search() scans at once
+    overlap_size = 16 * 1024  # bytes after these in which their matches may end
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.blocks = []  # (first line, line after the last)
+        self.postings = {}  # trigram -> bitset of blocks
+        self.indexed_lines = 0
+        self._pending = []  # texts of the next block
+        self._pending_size = 0
+        self._pending_lines = 0
+
+    def add(self, text):
+        """
+        Indexes output that ends at a line break (except for the last).
+        """
+        self._pending.append(text)
+        self._pending_size += len(text)
+        self._pending_lines += text.count('\n')
+        if self._pending_size >= self.block_size and text.endswith('\n'):
+            block_text = ''.join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            bit = 1 << len(self.blocks)
+            postings = self.postings
+            for gram in trigrams(normalize(block_text)):
+                postings[gram] = postings.get(gram, 0) | bit
+            start = self.indexed_lines
+            self.indexed_lines += self._pending_lines
+            self._pending_lines = 0
+            # only after its postings, for search() in the other thread
+            self.blocks.append((start, self.indexed_lines))
+
+    def search(self, pattern, literals=()):
+        """
+        Yields the matches of the compiled pattern in the spool as lists of
+        (line, column, length), a few blocks at a time. Every match contains
+        all literals.
+
+        Matches may span lines (and blocks), but only overlap_size bytes past
+        the lines that are scanned at once are searched, so longer ones may
+        be missed.
+        """
+        line_count = self.spool.line_count
+        # the lines of the blocks must be complete in the spool
+        blocks = self.blocks[:]
+        while blocks and blocks[-1][1] >= line_count:
+            blocks.pop()
+        # a match may continue in the next block, or in the lines after the
+        # last one, which have not been indexed yet
+        candidates = (1 << len(blocks)) - 1
+        for gram in trigrams(normalize(' '.join(literals))):
+            blocks_with_gram = self.postings.get(gram, 0)
+            candidates &= blocks_with_gram | blocks_with_gram >> 1
+        if blocks:
+            candidates |= 1 << (len(blocks) - 1)
+
+        # adjacent blocks are scanned together, as matches may span them
+        start = stop = 0
+        for number, block in enumerate(blocks):
+            if not candidates >> number & 1:
+                continue
+            if block[0] != stop:
+                yield from self._scan(pattern, start, stop, line_count)
+                start = block[0]
+            stop = block[1]
+        # along with the lines after the last block
+        yield from self._scan(pattern, start, line_count, line_count)
+
+    def _scan(self, pattern, start, stop, line_count):
+        """
+        Yields the matches that begin in the lines start..stop-1.
+        """
+        line_offsets = self.spool.line_offsets
+        skip = 0  # chars of the next piece that are part of a match already
+        while start < stop:
+            # in pieces of whole lines, followed by a few more lines in which
+            # their matches may end
+            end = min(stop, max(
+                start + 1, bisect_left(line_offsets, line_offsets[start] + self.scan_size, start, stop)
+            ))
+            overlap_end = end
+            if end < line_count:
+                overlap_end = min(line_count, bisect_left(
+                    line_offsets, line_offsets[end] + self.overlap_size, end, line_count
+                ) + 1)
+            text = ''.join(text for stream, text in self.spool.read_lines(start, end))
+            overlap = ''.join(text for stream, text in self.spool.read_lines(end, overlap_end))
+            matches, match_end = self._scan_lines(pattern, text + overlap, start, skip, len(text))
+            yield matches
+            skip = max(0, match_end - len(text))
+            start = end
+
+    def _scan_lines(self, pattern, text, line, begin, end):
+        """
+        Returns the matches in the text (which starts at the line) that begin
+        between the chars begin and end, and where the last one ends.
+        """
+        matches = []
+        line_start = 0
+        position = 0
+        match_end = 0
+        for match in pattern.finditer(text, begin):
+            match_begin = match.start()
+            if match_begin >= end:
+                break
+            if match_begin == match.end():
+                continue
+            newlines = text.count('\n', position, match_begin)
+            if newlines:
+                line += newlines
+                line_start = text.rfind('\n', position, match_begin) + 1
+            position = match_begin
+            match_end = match.end()
+            matches.append((line, match_begin - line_start, match_end - match_begin))
+        return matches, match_end
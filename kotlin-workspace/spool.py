@@ -0,0 +1,100 @@
+from array import array
+from bisect import bisect_right
+import mmap
+import tempfile
+
+
+class OutputSpool:
+    """
+    Append-only on-disk store of the output of a run that can be read back by
+    line numbers.
+
+    Text is stored UTF-8 encoded in an anonymous temporary file and read back
+    through a memory map. The spool keeps the byte offsets of all line starts
+    and of all changes between streams in compact arrays, so its memory use
+    does not grow with the size of the output but only with its line count.
+    A stream can be any hashable label, such as the style tuples of a
+    terminal.Terminal.
+    """
+    def __init__(self, directory=None):
+        self._file = tempfile.TemporaryFile(prefix='kotlin-workspace-output-', dir=directory, buffering=0)
+        self.size = 0  # bytes
+        self.line_offsets = array('Q', [0])
+        self.stream_offsets = array('Q')
+        self.streams = []
+        self._map = None
+
+    @property
+    def line_count(self):
+        """
+        Number of lines, counting the (possibly empty) last line that has not
+        been terminated yet.
+        """
+        return len(self.line_offsets)
+
+    def append(self, stream, text):
+        data = text.encode('utf-8', 'surrogatepass')
+        if not data:
+            return
+        if not self.streams or self.streams[-1] != stream:
+            self.stream_offsets.append(self.size)
+            self.streams.append(stream)
+
+        self._file.write(data)
+        index = data.find(b'\n')
+        while index >= 0:
+            self.line_offsets.append(self.size + index + 1)
+            index = data.find(b'\n', index + 1)
+        self.size += len(data)
+
+    def _mapping(self, end):
+        if self._map is None or len(self._map) < end:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self, begin, end):
+        """
+        Returns the bytes between the offsets as [(stream, text)].
+        """
+        if begin >= end:
+            return []
+        data = self._mapping(end)
+        segments = []
+        index = bisect_right(self.stream_offsets, begin) - 1
+        while begin < end:
+            next_offset = self.stream_offsets[index + 1] if index + 1 < len(self.stream_offsets) else end
+            stop = min(end, next_offset)
+            segments.append((self.streams[index], data[begin:stop].decode('utf-8', 'surrogatepass')))
+            begin = stop
+            index += 1
+        return segments
+
+    def read_lines(self, start, stop):
+        """
+        Returns the lines start..stop-1 (including their line breaks) as
+        [(stream, text)].
+        """
+        start = max(0, start)
+        stop = min(stop, self.line_count)
+        if start >= stop:
+            return []
+        end = self.line_offsets[stop] if stop < self.line_count else self.size
+        return self.read(self.line_offsets[start], end)
+
+    def write_to(self, file, chunk_size=2**20):
+        """
+        Writes all output, UTF-8 encoded, to a binary file.
+        """
+        if not self.size:
+            return
+        data = self._mapping(self.size)
+        for begin in range(0, self.size, chunk_size):
+            file.write(data[begin:min(begin + chunk_size, self.size)])
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
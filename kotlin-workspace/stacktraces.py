@@ -0,0 +1,45 @@
+import re
+
+import engine
+
+
+# lines of JVM stack traces, for example:
+#   Exception in thread "main" java.lang.IllegalStateException: boom
+#   	at Script.<init>(script.kts:3)
+#   	at java.base/jdk.internal.reflect.NativeConstructorAccessorImpl.newInstance0(Native Method)
+#   	... 12 more
+#   Caused by: java.io.IOException: closed
+HEADER_PATTERN = re.compile(
+    r'(?:Exception in thread "[^"]*" )?(?:[\w$]+\.)+[\w$]*(?:Exception|Error|Throwable)\b'
+)
+CAUSE_PATTERN = re.compile(r'\s*(?:Caused by|Suppressed): ')
+FRAME_PATTERN = re.compile(r'\s+at [\w$.<>/@-]+\(')
+ELIDED_PATTERN = re.compile(r'\s+\.\.\. \d+ (?:more|common frames omitted)')
+# one of them is in every line of a stack trace
+HINTS = ('at ', '... ', 'Caused by: ', 'Suppressed: ', 'Exception', 'Error', 'Throwable')
+
+
+def might_contain(text):
+    """
+    Returns whether the text might contain a line of a stack trace, which is
+    much faster to tell for a whole chunk of output than classify() is for
+    each of its lines.
+    """
+    return any(hint in text for hint in HINTS)
+
+
+def classify(line):
+    """
+    Returns what kind of stack trace line the line is: 'header', 'cause',
+    'script_frame' (of the user's script), 'frame' (of any other code),
+    'elided' or None if it is not part of a stack trace.
+    """
+    if FRAME_PATTERN.match(line):
+        return 'script_frame' if engine.FILE_LOCATION_PATTERN.search(line) else 'frame'
+    if ELIDED_PATTERN.match(line):
+        return 'elided'
+    if CAUSE_PATTERN.match(line):
+        return 'cause'
+    if HEADER_PATTERN.match(line):
+        return 'header'
+    return None
@@ -0,0 +1,327 @@
+import re
+
+
+# The 16 basic colors. All colors are mapped to them so that the output pane
+# gets by with a fixed set of tags.
+PALETTE = {
+    'black': (0x00, 0x00, 0x00),
+    'red': (0xcd, 0x00, 0x00),
+    'green': (0x00, 0xcd, 0x00),
+    'yellow': (0xcd, 0xcd, 0x00),
+    'blue': (0x00, 0x00, 0xee),
+    'magenta': (0xcd, 0x00, 0xcd),
+    'cyan': (0x00, 0xcd, 0xcd),
+    'white': (0xe5, 0xe5, 0xe5),
+    'bright-black': (0x7f, 0x7f, 0x7f),
+    'bright-red': (0xff, 0x00, 0x00),
+    'bright-green': (0x00, 0xff, 0x00),
+    'bright-yellow': (0xff, 0xff, 0x00),
+    'bright-blue': (0x5c, 0x5c, 0xff),
+    'bright-magenta': (0xff, 0x00, 0xff),
+    'bright-cyan': (0x00, 0xff, 0xff),
+    'bright-white': (0xff, 0xff, 0xff),
+}
+COLORS = list(PALETTE)
+ATTRIBUTES = ('bold', 'italic', 'underline')
+
+
+def foreground_tag(color):
+    return f'ansi-fg-{color}'
+
+
+def background_tag(color):
+    return f'ansi-bg-{color}'
+
+
+def attribute_tag(attribute):
+    return f'ansi-{attribute}'
+
+
+# all tags that styles can consist of, besides the name of the stream
+TAGS = [
+    *map(foreground_tag, COLORS),
+    *map(background_tag, COLORS),
+    *map(attribute_tag, ATTRIBUTES),
+]
+
+CONTROL_PATTERN = re.compile(
+    r'\r|\x08'
+    r'|\x1b\[(?P<parameters>[0-9;:?<=>]*)[ -/]*(?P<command>[@-~])'  # CSI
+    r'|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)'  # OSC, e.g. window titles
+    r'|\x1b[ -/]*[0-~]'
+    r'|[\x00-\x07\x0b\x0c\x0e-\x1f\x7f]'  # line breaks are handled separately
+)
+PARTIAL_ESCAPE_PATTERN = re.compile(r'\x1b(?:\[[0-9;:?<=>]*[ -/]*|\][^\x07\x1b]*\x1b?|[ -/]*)')
+max_partial_escape = 256  # chars, longer sequences are dropped as garbage
+
+
+def slice_segments(segments, start, end):
+    """
+    Returns the columns start..end-1 of a line given as [(style, text)].
+    """
+    sliced = []
+    offset = 0
+    for style, text in segments:
+        if offset >= end:
+            break
+        segment_end = offset + len(text)
+        if segment_end > start:
+            sliced.append((style, text[max(0, start - offset):end - offset]))
+        offset = segment_end
+    return sliced
+
+
+def nearest_color(red, green, blue):
+    return min(COLORS, key=lambda color: sum(
+        (a - b) ** 2 for a, b in zip(PALETTE[color], (red, green, blue))
+    ))
+
+
+def indexed_color(index):
+    """
+    Maps a color of the 256-color palette to one of the 16 basic colors.
+    """
+    if index < 16:
+        return COLORS[index]
+    if index < 232:
+        levels = (0, 95, 135, 175, 215, 255)
+        index -= 16
+        return nearest_color(levels[index // 36], levels[index // 6 % 6], levels[index % 6])
+    gray = 8 + 10 * (index - 232)
+    return nearest_color(gray, gray, gray)
+
+
+class Terminal:
+    """
+    Minimal terminal emulation for the output of a run.
+
+    Carriage returns, backspaces, cursor movements within the line and
+    erase-line sequences edit the current line like a terminal would, and SGR
+    sequences set colors and attributes. Everything else is dropped. feed()
+    returns the lines that have been completed as [(style, text)], where style
+    is a tuple of the stream and the TAGS that apply. The current line is only
+    kept here, so a progress bar that is redrawn many times between two
+    updates of the UI costs a single redraw there.
+
+    Both streams write to the same line, as they would in a terminal, but keep
+    their own colors.
+    """
+    def __init__(self):
+        self.line = []  # [(style, text)]
+        self.length = 0
+        self.column = 0
+        # the column from which on the current line has changed since the
+        # last take_changes(), or None
+        self.changed_from = 0
+        self._attributes = {}  # stream -> {'fg': color, 'bg': color, 'bold': bool, ...}
+        self._styles = {}
+        self._partial = {}  # stream -> start of an escape sequence
+        self._committed = []  # [(style, [text])]
+
+    def style(self, stream):
+        style = self._styles.get(stream)
+        if style is None:
+            attributes = self._attributes.get(stream, {})
+            tags = [stream]
+            if attributes.get('fg'):
+                tags.append(foreground_tag(attributes['fg']))
+            if attributes.get('bg'):
+                tags.append(background_tag(attributes['bg']))
+            tags.extend(attribute_tag(attribute) for attribute in ATTRIBUTES if attributes.get(attribute))
+            style = self._styles[stream] = tuple(tags)
+        return style
+
+    def feed(self, stream, text):
+        """
+        Processes output of the stream. Returns the completed lines.
+        """
+        # \r\n ends a line like \n does, but is much cheaper this way
+        text = (self._partial.pop(stream, '') + text).replace('\r\n', '\n')
+        escape = text.rfind('\x1b', max(0, len(text) - max_partial_escape))
+        if escape >= 0 and PARTIAL_ESCAPE_PATTERN.fullmatch(text, escape):
+            # wait for the rest of the sequence
+            self._partial[stream] = text[escape:]
+            text = text[:escape]
+
+        position = 0
+        for match in CONTROL_PATTERN.finditer(text):
+            if match.start() > position:
+                self._write_text(stream, text[position:match.start()])
+            position = match.end()
+            control = match.group()
+            if control == '\r':
+                self.column = 0
+            elif control == '\b':
+                self.column = max(0, self.column - 1)
+            elif match.group('command'):
+                self._csi(stream, match.group('parameters'), match.group('command'))
+        if position < len(text):
+            self._write_text(stream, text[position:])
+
+        return self._take_committed()
+
+    def flush(self):
+        """
+        Completes the current line, if any, without adding a line break.
+        Returns it like feed().
+        """
+        if self.line:
+            self._add_committed(self.line)
+        self._clear_line()
+        return self._take_committed()
+
+    def line_segments(self, start=0):
+        """
+        Returns the current line from the column on as [(style, text)].
+        """
+        return self._slice(start, self.length)
+
+    def take_changes(self):
+        """
+        Returns the column from which on the current line has changed since
+        the last call, or None if it has not.
+        """
+        changed_from, self.changed_from = self.changed_from, None
+        return changed_from
+
+    def _changed(self, column):
+        if self.changed_from is None or column < self.changed_from:
+            self.changed_from = column
+
+    def _add_committed(self, segments):
+        for style, text in segments:
+            if self._committed and self._committed[-1][0] == style:
+                self._committed[-1][1].append(text)
+            else:
+                self._committed.append((style, [text]))
+
+    def _take_committed(self):
+        committed = [(style, ''.join(parts)) for style, parts in self._committed]
+        self._committed = []
+        return committed
+
+    def _clear_line(self):
+        self.line = []
+        self.length = 0
+        self.column = 0
+        self.changed_from = 0
+
+    def _commit_line(self, stream):
+        self._add_committed(self.line + [(self.style(stream), '\n')])
+        self._clear_line()
+
+    def _write_text(self, stream, text):
+        # Lines in between line breaks cannot be changed anymore and are
+        # committed as a whole.
+        first, newline, rest = text.partition('\n')
+        self._write(stream, first)
+        if not newline:
+            return
+        self._commit_line(stream)
+        middle, newline, last = rest.rpartition('\n')
+        if newline:
+            self._add_committed([(self.style(stream), middle + newline)])
+        self._write(stream, last)
+
+    def _write(self, stream, text):
+        if not text:
+            return
+        style = self.style(stream)
+        if self.column > self.length:
+            self._write_at_end(style, ' ' * (self.column - self.length))
+        if self.column == self.length:
+            self._write_at_end(style, text)
+            return
+
+        end = self.column + len(text)
+        self._changed(self.column)
+        segments = self._slice(0, self.column) + [(style, text)] + self._slice(end, self.length)
+        self.line = []
+        for segment in segments:
+            if self.line and self.line[-1][0] == segment[0]:
+                self.line[-1] = (segment[0], self.line[-1][1] + segment[1])
+            else:
+                self.line.append(segment)
+        self.length = max(self.length, end)
+        self.column = end
+
+    def _write_at_end(self, style, text):
+        self._changed(self.length)
+        if self.line and self.line[-1][0] == style:
+            self.line[-1] = (style, self.line[-1][1] + text)
+        else:
+            self.line.append((style, text))
+        self.length += len(text)
+        self.column = self.length
+
+    def _slice(self, start, end):
+        return slice_segments(self.line, start, end)
+
+    def _csi(self, stream, parameters, command):
+        numbers = [int(number) if number.isdigit() else None for number in re.split('[;:]', parameters)]
+        count = numbers[0] or 1
+        if command == 'm':
+            self._select_graphic_rendition(stream, numbers)
+        elif command == 'K':
+            mode = numbers[0] or 0
+            if mode == 0:
+                self._changed(self.column)
+                self.line = self._slice(0, self.column)
+                self.length = min(self.length, self.column)
+            elif mode == 1:
+                column = self.column
+                self.column = 0
+                self._write(stream, ' ' * min(column + 1, self.length))
+                self.column = column
+            elif mode == 2:
+                self._changed(0)
+                self.line = []
+                self.length = 0
+        elif command == 'G':
+            self.column = count - 1
+        elif command == 'C':
+            self.column += count
+        elif command == 'D':
+            self.column = max(0, self.column - count)
+
+    def _select_graphic_rendition(self, stream, numbers):
+        attributes = self._attributes.setdefault(stream, {})
+        self._styles.pop(stream, None)
+        numbers = iter(numbers)
+        for number in numbers:
+            if number is None or number == 0:
+                attributes.clear()
+            elif number == 1:
+                attributes['bold'] = True
+            elif number == 3:
+                attributes['italic'] = True
+            elif number == 4:
+                attributes['underline'] = True
+            elif number == 22:
+                attributes['bold'] = False
+            elif number == 23:
+                attributes['italic'] = False
+            elif number == 24:
+                attributes['underline'] = False
+            elif 30 <= number <= 37:
+                attributes['fg'] = COLORS[number - 30]
+            elif 90 <= number <= 97:
+                attributes['fg'] = COLORS[number - 90 + 8]
+            elif 40 <= number <= 47:
+                attributes['bg'] = COLORS[number - 40]
+            elif 100 <= number <= 107:
+                attributes['bg'] = COLORS[number - 100 + 8]
+            elif number == 39:
+                attributes['fg'] = None
+            elif number == 49:
+                attributes['bg'] = None
+            elif number in (38, 48):
+                key = 'fg' if number == 38 else 'bg'
+                mode = next(numbers, None)
+                if mode == 5:
+                    index = next(numbers, None)
+                    if index is not None and index < 256:
+                        attributes[key] = indexed_color(index)
+                elif mode == 2:
+                    red, green, blue = (next(numbers, None) or 0 for _ in range(3))
+                    attributes[key] = nearest_color(red, green, blue)
@@ -0,0 +1,92 @@
+import json
+import platform
+import time
+
+import toolchain
+
+
+def record(script_run, **fields):
+    """
+    Returns a JSON-serializable summary of the timings of a finished
+    engine.ScriptRun. The phases (and the samples of the resource usage, if it
+    was measured) are in seconds since the start of the run, which is also
+    given as a Unix time so that runs can be lined up.
+    """
+    start = script_run.timings.get('start')
+    kotlin_home = toolchain.find_kotlin_home()
+    try:
+        kotlin_version = toolchain.kotlin_version(kotlin_home) if kotlin_home else None
+    except OSError:
+        kotlin_version = None
+    usage = None
+    if script_run.usage is not None and start is not None:
+        usage = script_run.usage.series()
+        usage['times'] = [seconds - start for seconds in usage['times']]
+    return {
+        **fields,
+        'started_at': None if start is None else start + time.time() - time.monotonic(),
+        # in the order in which they were reached
+        'phases': {
+            phase: seconds - start
+            for phase, seconds in sorted(script_run.timings.items(), key=lambda item: item[1])
+            if start is not None
+        },
+        'exit_code': script_run.exit.code if script_run.exit else None,
+        'reason': script_run.exit.reason if script_run.exit else None,
+        'kotlin_version': kotlin_version,
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'usage': usage,
+    }
+
+
+def summarize(values):
+    """
+    Returns the count, mean and max of the values or None if there are none.
+    """
+    if not values:
+        return None
+    return {'count': len(values), 'mean': sum(values) / len(values), 'max': max(values)}
+
+
+def format_phases(phases):
+    """
+    Returns a compact breakdown like "spawn 0.05s, first_stdout 1.20s".
+    """
+    return ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in phases.items() if phase != 'start')
+
+
+def append_json_lines(path, records):
+    with open(path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def write_trace(path, records):
+    """
+    Writes the records as a Chrome trace-event file (for chrome://tracing or
+    Perfetto) with one row per run and one slice per phase, which ends when
+    the phase is reached.
+    """
+    events = []
+    for index, record in enumerate(records):
+        if record['started_at'] is None:
+            continue
+        name = record.get('title') or record.get('file') or f'Run {index + 1}'
+        events.append({
+            'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': index,
+            'args': {'name': name},
+        })
+        previous = 0.0
+        for phase, seconds in sorted(record['phases'].items(), key=lambda item: item[1]):
+            if phase == 'start':
+                continue
+            events.append({
+                'name': phase, 'cat': 'run', 'ph': 'X', 'pid': 1, 'tid': index,
+                'ts': (record['started_at'] + previous) * 1e6,
+                'dur': (seconds - previous) * 1e6,
+                'args': {'exit_code': record['exit_code']},
+            })
+            previous = seconds
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
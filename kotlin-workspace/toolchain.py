@@ -0,0 +1,109 @@
+import hashlib
+import os
+import shutil
+import subprocess
+
+
+KOTLINC = 'kotlinc'
+JAVA = 'java'
+
+HOST_SOURCE = f'{os.path.dirname(__file__)}/assets/ScriptHost.kt'
+HOST_MAIN_CLASS = 'ScriptHostKt'
+
+
+class ToolchainError(Exception):
+    pass
+
+
+def find_kotlin_home():
+    """
+    Returns the root of the Kotlin installation that provides KOTLINC, or None
+    if there is none.
+    """
+    home = os.environ.get('KOTLIN_HOME')
+    if home:
+        return home
+
+    kotlinc = shutil.which(KOTLINC)
+    if kotlinc is None:
+        return None
+    # <home>/bin/kotlinc, usually reached through a symlink
+    return os.path.dirname(os.path.dirname(os.path.realpath(kotlinc)))
+
+
+def find_java():
+    java_home = os.environ.get('JAVA_HOME')
+    if java_home:
+        return os.path.join(java_home, 'bin', JAVA)
+    return JAVA
+
+
+def compiler_jar(kotlin_home):
+    return os.path.join(kotlin_home, 'lib', 'kotlin-compiler.jar')
+
+
+def cache_dir(*parts):
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = os.path.join(root, 'kotlin-workspace', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def kotlin_version(kotlin_home):
+    """
+    Returns an identifier of the Kotlin installation that changes whenever the
+    compiler does.
+    """
+    try:
+        with open(os.path.join(kotlin_home, 'build.txt')) as f:
+            return f.read().strip()
+    except OSError:
+        pass
+    # Not a standard distribution, fall back to the identity of the compiler
+    stat = os.stat(compiler_jar(kotlin_home))
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def host_jar(kotlin_home):
+    """
+    Returns the path of the compiled ScriptHost helper, compiling it first if
+    necessary. The helper is rebuilt whenever its source or the Kotlin
+    installation changes.
+    """
+    with open(HOST_SOURCE, 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(kotlin_version(kotlin_home).encode())
+    jar = os.path.join(cache_dir('host'), f'script-host-{digest.hexdigest()[:16]}.jar')
+    if os.path.exists(jar):
+        return jar
+
+    partial = f'{jar}.{os.getpid()}.tmp.jar'
+    try:
+        result = subprocess.run(
+            [os.path.join(kotlin_home, 'bin', KOTLINC), HOST_SOURCE,
+             '-cp', compiler_jar(kotlin_home), '-d', partial],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+    except FileNotFoundError:
+        raise ToolchainError(f"{KOTLINC} not found. Please make sure it is in your PATH.")
+    if result.returncode != 0:
+        raise ToolchainError(f"Could not compile {HOST_SOURCE}:\n{result.stdout.decode(errors='replace')}")
+    os.replace(partial, jar)
+    return jar
+
+
+def host_command(kotlin_home, *args, jvm_options=()):
+    """
+    Returns the command line that runs ScriptHost with the given arguments.
+    """
+    classpath = os.pathsep.join([host_jar(kotlin_home), compiler_jar(kotlin_home)])
+    return [
+        find_java(),
+        *jvm_options,
+        f'-Dkotlin.home={kotlin_home}',
+        '-cp', classpath,
+        HOST_MAIN_CLASS,
+        *args
+    ]
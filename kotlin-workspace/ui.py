@@ -1,88 +1,1016 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
 import tkinter as tk
+import tkinter.filedialog
+import tkinter.font
 import tkinter.scrolledtext
 import tkinter.ttk
+import math
 import os
 import Pmw
-import psutil
-from queue import Queue
+from queue import Empty, Queue
 import re
-import selectors
-import subprocess
-from threading import Thread
-
+import threading
+import time
+import traceback
+
+import cache
+import cds
+import daemon
+import engine
+import folding
+import pool
+import processes
+import search
+import spool
+import terminal
+import timings
 import ui_helpers
 
 
-KOTLINC = 'kotlinc'
-SCRIPT_BASENAME = 'script'
-SCRIPT_EXT = 'kts'
-SCRIPT_NAME = f'{SCRIPT_BASENAME}.{SCRIPT_EXT}'
+# added to the style of the script locations in the output
+LOCATION_TAG = 'location'
 
 
-class ScriptRunner(Thread):
+def mark_locations(segments):
+    """
+    Splits the script locations in the stderr segments of complete lines
+    into segments of their own, whose style ends with LOCATION_TAG.
+    """
+    marked = []
+    for style, text in segments:
+        if style[0] != 'stderr':
+            marked.append((style, text))
+            continue
+        start = 0
+        for location in engine.find_locations(text):
+            if location.start > start:
+                marked.append((style, text[start:location.start]))
+            marked.append(((*style, LOCATION_TAG), text[location.start:location.end]))
+            start = location.end
+        if start < len(text):
+            marked.append((style, text[start:]))
+    return marked
+
+
+class TerminalOutput(namedtuple('TerminalOutput', ['kind', 'segments', 'line_changed_from', 'line_segments'])):
     """
-    Runs a script in a separate thread and sends output to the output queue.
+    Output after the terminal emulation: the lines that have been completed
+    as [(style, text)] (see terminal.Terminal and mark_locations()) and the
+    change of the current line, which is line_segments from the column
+    line_changed_from on (or None if it has not changed).
+    """
+    __slots__ = ()
+
+    def __new__(cls, segments, line_changed_from, line_segments):
+        return super().__new__(cls, 'terminal', segments, line_changed_from, line_segments)
+
 
-    The output queue will receive tuples of the form (stream, chunk) like this:
-        ('stdout', 'Hello, world!')
-        ('stderr', 'Error: foo is not defined')
-        ('exit', 1)
+class ScriptRunner:
     """
-    def __init__(self, script, output_queue):
-        super().__init__()
-        self.script = script
+    Runs a script on the shared event loop and sends its events to the output
+    queue.
+
+    The output queue will receive the events of engine.ScriptRun, which are
+    tuples like these:
+        ('stdout', 'Hello, world!', ())
+        ('stderr', 'script.kts:1:1: error: foo', [Location(0, 14, 1, 1)])
+        ('cache', 'hit')
+        ('exit', 1, None)
+    With emulate_terminal, the output goes through a terminal.Terminal on the
+    event loop instead, so the queue receives TerminalOutput events, and the
+    locations are marked in the completed lines. These lines are also added to
+    the output_index (search.OutputIndex) if one is given, so that indexing
+    does not take time from the UI thread.
+    If a waker (ui_helpers.Waker) is given, it is woken up after each event.
+
+    The time.monotonic() at which the oldest event that has not been taken
+    from the queue was sent is kept in pending_since (and reset by the
+    consumer), so that the consumer can measure its latency.
+    """
+    def __init__(self, loop_thread, script, output_queue, waker=None, emulate_terminal=False, output_index=None,
+                 **options):
+        self.loop_thread = loop_thread
+        self.terminal = terminal.Terminal() if emulate_terminal else None
+        self.output_index = output_index
+        # locations in the terminal output are only found once the lines are complete
+        self.script_run = engine.ScriptRun(script, scan_locations=not emulate_terminal, **options)
         self.output_queue = output_queue
-        self.process = None
+        self.waker = waker
+        self.future = None
+        self.pending_since = None
+        self.render_latencies = array('d')  # s, see ScriptTab.update_output()
+
+    def start(self):
+        self.future = self.loop_thread.submit(self._forward())
+
+    async def _forward(self):
+        # Like the events of the run, the queue must end with an Exit event
+        # even if something fails here.
+        exited = False
+        try:
+            async for event in self.script_run:
+                if self.terminal is not None:
+                    if event.kind in ('stdout', 'stderr'):
+                        event = self._emulate(self.terminal.feed(event.kind, event.chunk))
+                        if event is None:
+                            continue
+                    elif event.kind == 'exit':
+                        # an unterminated last line is complete now
+                        output = self._emulate(self.terminal.flush())
+                        if output is not None:
+                            self._put(output)
+                exited = event.kind == 'exit'
+                self._put(event)
+        except Exception:
+            if exited:
+                raise
+            self.script_run.stop()
+            error = traceback.format_exc()
+            if self.terminal is not None:
+                self._put(TerminalOutput([(('stderr',), error)], None, []))
+            else:
+                self._put(engine.Output('stderr', error))
+            self._put(engine.Exit(1))
+
+    def _emulate(self, segments):
+        """
+        Returns the TerminalOutput for the completed lines and the changes of
+        the current line, or None if there are neither.
+        """
+        changed_from = self.terminal.take_changes()
+        if not segments and changed_from is None:
+            return None
+        line_segments = self.terminal.line_segments(changed_from) if changed_from is not None else []
+        if segments and self.output_index is not None:
+            self.output_index.add(''.join(text for style, text in segments))
+        return TerminalOutput(mark_locations(segments), changed_from, line_segments)
+
+    def _put(self, event):
+        self.output_queue.put(event)
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+        if self.waker is not None:
+            self.waker.wake()
 
-    def run(self):
-        with open(SCRIPT_NAME, "w") as f:
-            f.write(self.script)
+    def stop(self):
+        self.loop_thread.call(self.script_run.stop)
 
-        exit_code = self._run_script()
 
-        try:
-            os.remove(SCRIPT_NAME)
-        except FileNotFoundError:
-            pass
+class ScriptTab:
+    """
+    A script editor with its own output pane, status and runner. Tabs run
+    their scripts independently of each other.
+    """
+    def __init__(self, app, title, script):
+        self.app = app
+        self.root = app.root
+        self.title = title
+        self.output_queue = Queue()
+        self.script_runner = None
+        self.checking = False
+        self.precompile_runner = None
+        self.closed = False
+        self._precompile_job = None
+        self._precompiled_script = None
+        self._diagnostic_count = 0
+        self._update_job = None
+        self._last_update = 0.0
+
+        # All output goes through the terminal of the runner, whose completed
+        # lines go to the spool. The output pane only shows the lines
+        # view_start.. of the spool, with lines folded by the folder, and
+        # line_numbers holds the line in the spool of each line in the pane.
+        # While following, new lines are appended to the pane, followed by the
+        # current line of the terminal (as of the output taken from the queue
+        # so far) from the mark 'terminal_line' on, otherwise the pane shows
+        # an older page.
+        self.terminal_line = []  # [(style, text)]
+        self._line_changed_from = None  # column from which on it has not been drawn yet
+        self.spool = None
+        self.folder = None
+        self.line_numbers = array('Q')
+        self._undrawn_output = []
+        self.view_start = 0
+        self.following = True
+
+        # Searches go through the index of the spool, so they cover all
+        # output. The matches are kept as (line, column, length) in the
+        # spool.
+        self.search_index = None
+        self._search_query = None
+        self._search_results = None
+        self._search_job = None
+        self._searched_size = 0  # of the spool when the search was started
+        self._resume_after = None  # (line, column) of the match shown before the search was repeated
+        self.search_matches = []
+        self.match_index = None
+
+        self._init_ui(script)
+
+    update_interval = 100  # ms, for polling speculative compiles
+    min_update_interval = 10  # ms between updates of the output, which coalesces it
+    frame_budget = 0.02  # s of rendering per update
+    max_batch_chars = 32 * 1024  # drawn at once, which a tick may overrun frame_budget by
+    max_visible_lines = 5000
+    page_lines = 1000
+    precompile_delay = 500  # ms after the last edit
+
+    def _init_ui(self, script):
+        app = self.app
+        self.frame = tk.Frame(app.notebook)
+
+        self.buttonbar = tk.Frame(self.frame)
+        self.buttonbar.pack(side='top', fill='x')
+
+        self.input_pane = app._make_text_pane(self.frame, width=1, height=1)
+        self.input_pane.pack(side='left', fill='both', expand=True)
+        self.input_pane.insert('1.0', script)
+        self.input_pane.edit_modified(False)
+        self.input_pane.bind('<<Modified>>', self._input_modified)
+        self.input_pane.tag_config('diagnostic', background='#ffd0d0')
+        self.input_pane.balloon = Pmw.Balloon(self.root)
+
+        self.output_frame = tk.Frame(self.frame, width=1, height=1)
+        self.output_frame.pack(side='right', fill='both', expand=True)
+
+        self.pagerbar = tk.Frame(self.output_frame)
+        self.pagerbar.pack(side='top', fill='x')
+        self.pager_label = tk.Label(self.pagerbar)
+        self.pager_label.pack(side='left')
+        tk.Button(self.pagerbar, text="Latest", command=self.show_latest_output).pack(side='right')
+        tk.Button(self.pagerbar, text="Newer", command=self.show_newer_output).pack(side='right')
+        tk.Button(self.pagerbar, text="Older", command=self.show_older_output).pack(side='right')
+        ui_helpers.hide_widget(self.pagerbar)
+
+        self.searchbar = tk.Frame(self.output_frame)
+        self.searchbar.pack(side='top', fill='x')
+        self.search_entry = tk.Entry(self.searchbar)
+        self.search_entry.pack(side='left', fill='x', expand=True)
+        self.search_entry.bind('<Return>', lambda event: self.find_next())
+        self.search_entry.bind('<Shift-Return>', lambda event: self.find_previous())
+        self.search_entry.bind('<Escape>', lambda event: self.hide_search())
+        self.search_regex = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.searchbar, text="Regex", variable=self.search_regex).pack(side='left')
+        self.search_match_case = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.searchbar, text="Match case", variable=self.search_match_case).pack(side='left')
+        self.search_label = tk.Label(self.searchbar)
+        self.search_label.pack(side='left')
+        tk.Button(self.searchbar, text="Close", command=self.hide_search).pack(side='right')
+        tk.Button(self.searchbar, text="Next", command=self.find_next).pack(side='right')
+        tk.Button(self.searchbar, text="Previous", command=self.find_previous).pack(side='right')
+        ui_helpers.hide_widget(self.searchbar)
+
+        self.diagnostics_table = ui_helpers.SortableTable(
+            self.output_frame, [('severity', "Severity"), ('row', "Row"), ('col', "Col"), ('message', "Message")],
+            height=6
+        )
+        for column, width in (('severity', 70), ('row', 50), ('col', 50)):
+            self.diagnostics_table.column(column, width=width, stretch=False)
+        self.diagnostics_table.pack(side='bottom', fill='x')
+        self.diagnostics_table.bind('<Double-1>', self._goto_diagnostic)
+        self.diagnostics_table.bind('<Return>', self._goto_diagnostic)
+        ui_helpers.hide_widget(self.diagnostics_table)
+
+        self.output_pane = app._make_text_pane(self.output_frame, readonly=True, width=1, height=1)
+        self.output_pane.pack(side='bottom', fill='both', expand=True)
+        self.output_pane.tag_config('stderr', foreground='red')
+        self._init_terminal_tags()
+        self.output_pane.mark_set('terminal_line', '1.0')
+        self.output_pane.mark_gravity('terminal_line', 'left')
+        self.output_pane.tag_config('fold_label', foreground='gray', font='TkSmallCaptionFont')
+        self.output_pane.tag_bind('fold_label', '<Enter>', lambda event: self.output_pane.config(cursor='hand2'))
+        self.output_pane.tag_bind('fold_label', '<Leave>', lambda event: self.output_pane.config(cursor=''))
+        self.output_pane.tag_bind('fold_label', '<Button-1>', self._expand_fold)
+        self.output_pane.tag_config('search_match', background='yellow')
+        self.output_pane.hyperlink_manager = ui_helpers.HyperlinkManager(
+            self.output_pane, lambda target: self.goto(*target)
+        )
+        self.waker = ui_helpers.Waker(self.output_pane, self.schedule_update)
+
+        self.run_button = app._make_button(self.buttonbar, "Run script", 'icon_run.png', self.run_script)
+        self.run_button.pack(side='left')
+
+        self.check_button = app._make_button(
+            self.buttonbar, "Check script (compile only)", 'icon_success.png', self.check_script
+        )
+        self.check_button.pack(side='left')
+
+        self.stop_button = app._make_button(self.buttonbar, "Stop script", 'icon_stop.png', self.stop_script)
+        self.stop_button.pack(side='left')
+
+        self.usage_frame = tk.Frame(self.buttonbar)
+        self.usage_frame.pack(side='left', padx=5)
+        self.usage_sparklines = {}
+        for field, color, tooltip in (
+            ('cpu_percent', 'red', "CPU usage of the script's processes"),
+            ('rss', 'blue', "Memory (RSS) of the script's processes"),
+            ('threads', 'green', "Threads of the script's processes"),
+            ('io_rate', 'purple', "Disk I/O of the script's processes"),
+        ):
+            sparkline = ui_helpers.Sparkline(self.usage_frame, color=color)
+            sparkline.pack(side='left', padx=1)
+            app._add_tooltip(sparkline, tooltip)
+            self.usage_sparklines[field] = sparkline
+        self.usage_label = tk.Label(self.usage_frame, font='TkSmallCaptionFont')
+        self.usage_label.pack(side='left')
+        ui_helpers.hide_widget(self.usage_frame)
+        self._last_usage_sample = None
+
+        self.loading_icon = app._make_animated_icon(self.buttonbar, 'loading.gif', "Running script...")
+        self.loading_icon.pack(side='right')
+
+        self.queued_label = tk.Label(self.buttonbar, text="Queued")
+        self.queued_label.pack(side='right')
+        app._add_tooltip(self.queued_label, "Waiting for other scripts to finish")
+        ui_helpers.hide_widget(self.queued_label)
+
+        self.success_icon = app._make_icon(self.buttonbar, 'icon_success.png', "Finished with exit code 0")
+        self.success_icon.pack(side='right')
+        ui_helpers.hide_widget(self.success_icon)
+
+        self.error_icon = app._make_icon(self.buttonbar, 'icon_error.png', "")
+        self.error_icon.pack(side='right')
+        ui_helpers.hide_widget(self.error_icon)
+
+        self.timing_label = tk.Label(self.buttonbar)
+        self.timing_label.pack(side='right')
+        app._add_tooltip(self.timing_label, "Seconds from the start of the run until each phase")
+        ui_helpers.hide_widget(self.timing_label)
+
+        app.notebook.add(self.frame, text=self.title)
+        self.set_busy(False)
+
+    def _init_terminal_tags(self):
+        font = tkinter.font.Font(font=self.output_pane['font'])
+        self.terminal_fonts = {}
+        for attribute, options in (('bold', {'weight': 'bold'}), ('italic', {'slant': 'italic'})):
+            self.terminal_fonts[attribute] = font.copy()
+            self.terminal_fonts[attribute].configure(**options)
+        for color in terminal.COLORS:
+            value = '#%02x%02x%02x' % terminal.PALETTE[color]
+            self.output_pane.tag_config(terminal.foreground_tag(color), foreground=value)
+            self.output_pane.tag_config(terminal.background_tag(color), background=value)
+        for attribute, font in self.terminal_fonts.items():
+            self.output_pane.tag_config(terminal.attribute_tag(attribute), font=font)
+        self.output_pane.tag_config(terminal.attribute_tag('underline'), underline=True)
+
+    @property
+    def busy(self):
+        return self.loading_icon.visible
+
+    def set_busy(self, busy):
+        self.loading_icon.visible = busy
+
+        self.run_button['state'] = 'disabled' if busy else 'normal'
+        self.check_button['state'] = 'disabled' if busy else 'normal'
+        self.stop_button['state'] = 'normal' if busy else 'disabled'
+
+        self.set_state("running" if busy else None)
+
+    def set_state(self, state):
+        self.app.notebook.tab(self.frame, text=f"{self.title} ({state})" if state else self.title)
+
+    def run_script(self, compile_only=False):
+        if self.busy:
+            return
+
+        self.set_busy(True)
+        self.checking = compile_only
+        ui_helpers.hide_widget(self.success_icon)
+        ui_helpers.hide_widget(self.error_icon)
+        ui_helpers.hide_widget(self.diagnostics_table)
+        ui_helpers.hide_widget(self.timing_label)
+        ui_helpers.hide_widget(self.usage_frame)
+        for sparkline in self.usage_sparklines.values():
+            sparkline.clear()
+        self._last_usage_sample = None
+
+        script = self.input_pane.get('1.0', tk.END)
+        # a speculative compile of the same script will be waited for
+        if self.precompile_runner is not None and self.precompile_runner.script_run.script != script:
+            self.cancel_precompile()
+
+        # clear output
+        with self.output_pane.unlocked():
+            self.output_pane.delete('1.0', tk.END)
+        self.output_pane.hyperlink_manager.reset()
+        self.terminal_line = []
+        self._line_changed_from = None
+        self.folder = folding.LineFolder()
+        self.line_numbers = array('Q')
+        self._undrawn_output = []
+        if self.spool is not None:
+            self.spool.close()
+        self.spool = spool.OutputSpool()
+        self.search_index = search.OutputIndex(self.spool)
+        self._reset_search()
+        self.view_start = 0
+        self.following = True
+        self._update_pager()
+
+        # start script
+        self.script_runner = ScriptRunner(
+            self.app.loop_thread, script, self.output_queue, waker=self.waker, emulate_terminal=True,
+            output_index=self.search_index, compile_only=compile_only, **self.app.run_options()
+        )
+        # the output is rendered whenever the runner wakes up the waker
+        self.script_runner.start()
+
+    def check_script(self):
+        """
+        Compiles the script without running it and lists the diagnostics of
+        the compiler.
+        """
+        self.run_script(compile_only=True)
+
+    def stop_script(self):
+        if not self.busy:
+            return
 
-        self.output_queue.put(('exit', exit_code))
+        self.script_runner.stop()
 
-    def _run_script(self):
+    def schedule_update(self):
+        """
+        Makes update_output() run soon, but not sooner than
+        min_update_interval after the last update.
+        """
+        if self.closed or self._update_job is not None:
+            return
+        elapsed = (time.monotonic() - self._last_update) * 1000
+        self._update_job = self.root.after(
+            max(0, int(self.min_update_interval - elapsed)), self.update_output
+        )
+
+    def update_output(self):
+        self._update_job = None
+        if self.closed:
+            return
+        self._last_update = time.monotonic()
+
+        # Render as much as fits into the frame budget, merging consecutive
+        # chunks of the same stream into a single insert.
+        deadline = time.monotonic() + self.frame_budget
+        runner = self.script_runner
+        with self.output_pane.unlocked():
+            while time.monotonic() < deadline:
+                pending_since = runner.pending_since
+                runner.pending_since = None
+                batch = self._drain_output(self.max_batch_chars)
+                if not batch:
+                    break
+                exit_item = None
+                for item_type, item in batch:
+                    if item_type == 'exit':
+                        exit_item = item
+                        break
+                    self._render(item_type, item)
+                self._draw_output(final=exit_item is not None)
+                if pending_since is not None:
+                    runner.render_latencies.append(time.monotonic() - pending_since)
+                if exit_item is not None:
+                    self._finish(exit_item)
+                    return
+
+        # out of budget
+        if not self.output_queue.empty():
+            self.schedule_update()
+
+    def _drain_output(self, max_chars):
+        """
+        Takes up to about max_chars of output from the queue. Returns a list
+        of (item_type, item) where item is a list of consecutive
+        TerminalOutputs for 'terminal' and the queue item otherwise.
+        """
+        batch = []
+        chars = 0
+        while chars < max_chars:
+            try:
+                item = self.output_queue.get_nowait()
+            except Empty:
+                break
+            item_type = item[0]
+            if item_type == 'terminal':
+                if not (batch and batch[-1][0] == item_type):
+                    batch.append((item_type, []))
+                batch[-1][1].append(item)
+                chars += sum(len(text) for style, text in item.segments)
+                continue
+            batch.append((item_type, item))
+            if item_type == 'exit':
+                break
+        return batch
+
+    def _render(self, item_type, item):
+        if item_type == 'queued':
+            ui_helpers.show_widget(self.queued_label)
+            self.set_state("queued")
+        elif item_type == 'started':
+            ui_helpers.hide_widget(self.queued_label)
+            self.set_state("running")
+        elif item_type == 'cache':
+            self.app.update_cache_label()
+        elif item_type == 'usage':
+            self._show_usage(item)
+        elif item_type == 'terminal':
+            segments = []
+            for output in item:
+                segments += output.segments
+                if output.line_changed_from is not None:
+                    self._change_terminal_line(output.line_changed_from, output.line_segments)
+            self._commit_output(segments)
+
+    def _change_terminal_line(self, changed_from, segments):
+        self.terminal_line = terminal.slice_segments(self.terminal_line, 0, changed_from) + segments
+        if self._line_changed_from is None or changed_from < self._line_changed_from:
+            self._line_changed_from = changed_from
+
+    def _commit_output(self, segments):
+        for style, text in segments:
+            self.spool.append(style, text)
+        if segments:
+            if self.following:
+                self._undrawn_output.extend(segments)
+            self._update_pager()
+
+    def _draw_output(self, final=False):
+        """
+        Appends the lines that the terminal has completed since the last call
+        to the output pane and redraws what has changed of its current line.
+        """
+        changed_from, self._line_changed_from = self._line_changed_from, None
+        segments, self._undrawn_output = self._undrawn_output, []
+        if not self.following:
+            return
+        if segments or final:
+            self.output_pane.delete('terminal_line', 'end-1c')
+            items = self.folder.feed(segments)
+            if final:
+                items += self.folder.flush()
+            self._insert_folded(items)
+            self._trim_output()
+            self.output_pane.mark_set('terminal_line', 'end-1c')
+            changed_from = 0
+        elif changed_from is None:
+            return
+        else:
+            self.output_pane.delete(f'terminal_line + {changed_from} chars', 'end-1c')
+        for style, text in terminal.slice_segments(self.terminal_line, changed_from, math.inf):
+            self.output_pane.insert(tk.END, text, style)
+
+    def _show_usage(self, sample):
+        previous = self._last_usage_sample
+        io_rate = 0.0
+        if previous is not None and sample.time > previous.time:
+            io_bytes = sample.read_bytes + sample.write_bytes - previous.read_bytes - previous.write_bytes
+            io_rate = max(0, io_bytes) / (sample.time - previous.time)
+        self._last_usage_sample = sample
+
+        for field, value in (
+            ('cpu_percent', sample.cpu_percent), ('rss', sample.rss),
+            ('threads', sample.threads), ('io_rate', io_rate)
+        ):
+            self.usage_sparklines[field].add(value)
+        self.usage_label['text'] = (
+            f"{sample.cpu_percent:.0f}% {sample.rss / 2**20:.0f} MiB "
+            f"{sample.threads} thr {io_rate / 2**20:.1f} MiB/s"
+        )
+        if previous is None:
+            ui_helpers.show_widget(self.usage_frame)
+
+    def _insert_folded(self, items):
+        """
+        Appends the output of LineFolder.feed() or flush() to the pane.
+        """
+        for item in items:
+            if item[0] == 'text':
+                _, segments, line_numbers = item
+                for style, text in segments:
+                    self._insert_output(style, text)
+                self.line_numbers.extend(line_numbers)
+            else:
+                _, line_number, label = item
+                # the line is the last one in the pane
+                self._set_fold_label(len(self.line_numbers), label)
+
+    def _set_fold_label(self, pane_line, text):
+        """
+        Shows what has been folded into a line at its end, or nothing if text
+        is None.
+        """
+        hyperlink_manager = self.output_pane.hyperlink_manager
+        label = self.output_pane.tag_prevrange('fold_label', f'{pane_line}.end')
+        if label and self.output_pane.compare(label[0], '>=', f'{pane_line}.0'):
+            if hyperlink_manager.starts:
+                hyperlink_manager.shift(hyperlink_manager.offset(label[0]), -len(self.output_pane.get(*label)))
+            self.output_pane.delete(*label)
+        if text is not None:
+            if hyperlink_manager.starts:
+                hyperlink_manager.shift(hyperlink_manager.offset(f'{pane_line}.end'), len(text))
+            self.output_pane.insert(f'{pane_line}.end', text, 'fold_label')
+
+    def _expand_fold(self, event):
+        """
+        Shows the next page_lines lines that have been folded into the line
+        whose label was clicked.
+        """
+        pane_line = int(self.output_pane.index(f'@{event.x},{event.y}').split('.')[0])
+        if self.line_numbers[pane_line - 1] in self.folder.runs:
+            self._expand(pane_line, self.page_lines)
+
+    def _expand(self, pane_line, limit):
+        """
+        Shows up to limit lines that have been folded into the line.
+        """
+        line_number = self.line_numbers[pane_line - 1]
+        unfolded, label = self.folder.expand(line_number, limit)
+        with self.output_pane.unlocked():
+            self._set_fold_label(pane_line, None)
+            self.output_pane.mark_set('fold_expansion', f'{pane_line + 1}.0')
+            for style, text in self.spool.read_lines(line_number + 1, line_number + 1 + unfolded):
+                self._insert_output(style, text, 'fold_expansion')
+            self.line_numbers[pane_line:pane_line] = array('Q', range(line_number + 1, line_number + 1 + unfolded))
+            self._set_fold_label(pane_line + unfolded, label)
+            if self.following:
+                # the mark stays in front of text that is inserted at it
+                self.output_pane.mark_set('terminal_line', f'{len(self.line_numbers) + 1}.0')
+
+    def show_search(self):
+        ui_helpers.show_widget(self.searchbar, before=self.output_pane)
+        self.search_entry.focus_set()
+        self.search_entry.select_range(0, tk.END)
+
+    def hide_search(self):
+        self._reset_search()
+        ui_helpers.hide_widget(self.searchbar)
+
+    def _reset_search(self):
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+            self._search_job = None
+        self._search_query = None
+        self._search_results = None
+        self._resume_after = None
+        self.search_matches = []
+        self.match_index = None
+        self.search_label['text'] = ""
+        self.output_pane.tag_remove('search_match', '1.0', tk.END)
+
+    def find_next(self):
+        self._find(1)
+
+    def find_previous(self):
+        self._find(-1)
+
+    def _find(self, step):
+        query = (self.search_entry.get(), self.search_regex.get(), self.search_match_case.get())
+        if self.search_index is None or not query[0]:
+            return
+        if query != self._search_query:
+            self._start_search(query)
+        elif self._search_job is None and self._searched_size < self.spool.size:
+            # more output has come in since, search again from the current match on
+            resume_after = None
+            if self.match_index is not None:
+                resume_after = self.search_matches[self.match_index][:2]
+            self._start_search(query, resume_after)
+        elif self.search_matches:
+            self._show_match((self.match_index + step) % len(self.search_matches))
+
+    def _start_search(self, query, resume_after=None):
+        self._reset_search()
+        text, regex, match_case = query
+        # many lines are matched at once, ^ and $ must still match at each of them
+        flags = re.MULTILINE if match_case else re.MULTILINE | re.IGNORECASE
         try:
-            self.process = subprocess.Popen(
-                [KOTLINC, '-script', SCRIPT_NAME],
-                stdin=subprocess.DEVNULL,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
+            pattern = re.compile(text if regex else re.escape(text), flags)
+        except re.error as error:
+            self.search_label['text'] = f"Invalid pattern: {error}"
+            return
+        self._search_query = query
+        self._resume_after = resume_after
+        self._searched_size = self.spool.size
+        self._search_results = self.search_index.search(
+            pattern, search.required_literals(text) if regex else [text]
+        )
+        self._continue_search()
+
+    def _continue_search(self):
+        """
+        Collects the matches of the search for frame_budget and continues
+        later if there are more blocks to scan.
+        """
+        self._search_job = None
+        deadline = time.monotonic() + self.frame_budget
+        for matches in self._search_results:
+            self.search_matches.extend(matches)
+            if time.monotonic() >= deadline:
+                self._search_job = self.root.after(1, self._continue_search)
+                break
+        if self.match_index is None and self.search_matches:
+            if self._resume_after is None:
+                self._show_match(0)
+            elif self.search_matches[-1][:2] > self._resume_after or self._search_job is None:
+                # the matches come in order of their lines
+                index = bisect_right(self.search_matches, self._resume_after + (2**32,))
+                self._show_match(index % len(self.search_matches))
+            else:
+                self._update_search_label()
+        else:
+            self._update_search_label()
+
+    def _update_search_label(self):
+        count = len(self.search_matches)
+        text = f"{count} {'match' if count == 1 else 'matches'}"
+        if self.match_index is not None:
+            text = f"{self.match_index + 1} of {text}"
+        if self._search_job is not None:
+            text += "..."
+        self.search_label['text'] = text
+
+    def _show_match(self, index):
+        self.match_index = index
+        self._update_search_label()
+        line, column, length = self.search_matches[index]
+        stop = self.spool.line_count if self.following else self.view_start + self.max_visible_lines
+        if not (self.line_numbers and self.view_start <= line < stop):
+            self._show_lines(line - self.max_visible_lines // 2)
+        pane_line = self._show_line(line)
+        start = f'{pane_line}.{column}'
+        self.output_pane.tag_remove('search_match', '1.0', tk.END)
+        self.output_pane.tag_add('search_match', start, f'{start} + {length} chars')
+        self.output_pane.see(start)
+
+    def _show_line(self, line_number):
+        """
+        Unfolds the line (of the spool) if it is in the pane but has been
+        folded. Returns the line in the pane that shows it (or that it has
+        been folded into).
+        """
+        index = bisect_right(self.line_numbers, line_number) - 1
+        anchor = self.line_numbers[index]
+        if anchor != line_number and line_number < anchor + self.folder.runs.get(anchor, 1):
+            self._expand(index + 1, line_number - anchor)
+            return index + 1 + line_number - anchor
+        return index + 1
+
+    def save_output(self, path):
+        """
+        Writes all output of the last run, without folding, to a file.
+        """
+        if self.spool is None:
+            return
+        with open(path, 'wb') as f:
+            self.spool.write_to(f)
+
+    def _insert_output(self, style, text, index=tk.END):
+        hyperlink_manager = self.output_pane.hyperlink_manager
+        if index != tk.END and hyperlink_manager.starts:
+            hyperlink_manager.shift(hyperlink_manager.offset(index), len(text))
+        if style[-1] != LOCATION_TAG:
+            self.output_pane.insert(index, text, style)
+            return
+        # The runner has found the locations (see mark_locations()), and the
+        # text consists of them, usually a single one. Insert them as
+        # hyperlinks with a single call.
+        locations = engine.find_locations(text)
+        offset = hyperlink_manager.offset('end-1c' if index == tk.END else index)
+        arguments = []
+        start = 0
+        for location in locations:
+            tags = hyperlink_manager.add(
+                offset + location.start, offset + location.end, (location.row, location.col - 1)
             )
-        except FileNotFoundError:
-            self.output_queue.put(('stderr', f"{KOTLINC} not found. Please make sure it is in your PATH."))
-            return 127
-
-        with self.process:
-            selector = selectors.DefaultSelector()
-            selector.register(self.process.stdout, selectors.EVENT_READ)
-            selector.register(self.process.stderr, selectors.EVENT_READ)
-            exited = False
-            while not exited:
-                for key, val1 in selector.select(timeout=0):
-                    chunk = key.fileobj.read1().decode()
-                    if not chunk:
-                        exited = True
-                        break
-                    if key.fileobj is self.process.stdout:
-                        self.output_queue.put(('stdout', chunk))
-                    else:
-                        self.output_queue.put(('stderr', chunk))
+            arguments += [
+                text[start:location.start], style,
+                text[location.start:location.end], (*style, tags)
+            ]
+            start = location.end
+        arguments += [text[start:], style]
+        self.output_pane.insert(index, *arguments)
+
+    def _trim_output(self):
+        # drop lines from the top in steps of page_lines so that this does not
+        # happen on every update
+        line_count = int(self.output_pane.index('end-1c').split('.')[0])
+        excess = line_count - self.max_visible_lines
+        if excess < self.page_lines:
+            return
+        self.output_pane.hyperlink_manager.forget_before(f'{excess + 1}.0')
+        self.output_pane.delete('1.0', f'{excess + 1}.0')
+        del self.line_numbers[:excess]
+        self.view_start = self.line_numbers[0]
+
+    def _show_lines(self, start):
+        """
+        Fills the output pane with the page of the spool that starts at the
+        given line.
+        """
+        line_count = self.spool.line_count
+        start = max(0, min(start, line_count - self.max_visible_lines))
+        stop = min(line_count, start + self.max_visible_lines)
+        with self.output_pane.unlocked():
+            self.output_pane.delete('1.0', tk.END)
+            self.output_pane.hyperlink_manager.reset()
+            self.following = stop == line_count
+            self.folder = folding.LineFolder(start)
+            self.line_numbers = array('Q')
+            items = self.folder.feed(self.spool.read_lines(start, stop))
+            if not (self.following and self.busy):
+                # no more lines follow
+                items += self.folder.flush()
+            self._insert_folded(items)
+            self.output_pane.mark_set('terminal_line', 'end-1c')
+            if self.following:
+                for style, text in self.terminal_line:
+                    self.output_pane.insert(tk.END, text, style)
+        self._line_changed_from = None
+        self._undrawn_output = []
+        self.view_start = start
+        self._update_pager()
+
+    def show_older_output(self):
+        if self.spool is None or self.view_start == 0:
+            return
+        previous_start = self.view_start
+        self._show_lines(previous_start - self.page_lines)
+        self.output_pane.see(f'{bisect_left(self.line_numbers, previous_start) + 1}.0')
 
-        return self.process.wait()
+    def show_newer_output(self):
+        if self.spool is None or self.following:
+            return
+        self._show_lines(self.view_start + self.page_lines)
+        self.output_pane.see(f'{self.max_visible_lines - self.page_lines}.0')
 
-    def stop(self):
-        # We need to kill the process and all its children because kotlinc
-        # spawns a java process but doesn't kill it when it receives SIGTERM autc.
-        parent = psutil.Process(self.process.pid)
-        for child in parent.children():
-            child.kill()
+    def show_latest_output(self):
+        if self.spool is None:
+            return
+        self._show_lines(self.spool.line_count)
+        self.output_pane.see(tk.END)
+
+    def _update_pager(self):
+        line_count = self.spool.line_count if self.spool is not None else 0
+        if line_count <= self.max_visible_lines and self.view_start == 0:
+            ui_helpers.hide_widget(self.pagerbar)
+            return
+        stop = line_count if self.following else min(line_count, self.view_start + self.max_visible_lines)
+        self.pager_label['text'] = f"Lines {self.view_start + 1}-{stop} of {line_count}"
+        ui_helpers.show_widget(self.pagerbar)
+
+    def _finish(self, item):
+        # all output before the exit has been rendered by now
+        script_run = self.script_runner.script_run
+        script_run.mark('rendered')
+        render_latency = timings.summarize(self.script_runner.render_latencies)
+        record = timings.record(script_run, title=self.title, render_latency=render_latency)
+        self.app.timing_records.append(record)
+        self.timing_label['text'] = timings.format_phases(record['phases'])
+        if render_latency is not None:
+            self.timing_label['text'] += f", render latency max {render_latency['max'] * 1000:.0f} ms"
+        ui_helpers.show_widget(self.timing_label)
+
+        exit_code = item[1]
+        if self.checking and item.reason is None:
+            self._show_check_result()
+        if exit_code == 0 and item.reason is None:
+            ui_helpers.show_widget(self.success_icon)
+        else:
+            if item.reason == 'stopped':
+                message = "Stopped"
+            elif item.reason is not None:
+                message = f"killed: {item.reason}"
+            else:
+                message = f"Finished with exit code {exit_code}"
+            if script_run.stop_seconds is not None:
+                message += f" (stopping took {script_run.stop_seconds:.2f}s)"
+            self.error_icon.balloon.unbind(self.error_icon)
+            self.error_icon.balloon.bind(self.error_icon, message)
+            ui_helpers.show_widget(self.error_icon)
+        ui_helpers.hide_widget(self.queued_label)
+        self.set_busy(False)
+        if self.app.use_cds.get():
+            # the run may have started creating the archive
+            self.app.update_cds_label()
+
+    def _input_modified(self, event):
+        if not self.input_pane.edit_modified():
+            return
+        self.input_pane.edit_modified(False)
+        if not self.app.precompile.get():
+            return
+        # the running compile is outdated, start a new one once the edits
+        # settle
+        self.cancel_precompile()
+        self._precompile_job = self.root.after(self.precompile_delay, self.precompile)
+
+    def precompile(self):
+        """
+        Compiles the script in the background so that a run can use the
+        result from the cache, and marks the errors in the input pane.
+        """
+        self.cancel_precompile()
+        script = self.input_pane.get('1.0', tk.END)
+        if script == self._precompiled_script:
+            return
+        self._precompiled_script = script
+
+        runner = ScriptRunner(self.app.loop_thread, script, Queue(), compile_only=True, **self.app.precompile_options())
+        runner.start()
+        self.precompile_runner = runner
+        self.root.after(self.update_interval, self._update_precompile, runner, [], [])
+
+    def cancel_precompile(self):
+        if self._precompile_job is not None:
+            self.root.after_cancel(self._precompile_job)
+            self._precompile_job = None
+        if self.precompile_runner is not None:
+            self.precompile_runner.stop()
+            self.precompile_runner = None
+            self._precompiled_script = None
+
+    def _update_precompile(self, runner, chunks, locations):
+        if self.closed or runner is not self.precompile_runner:
+            return
+
+        offset = sum(map(len, chunks))
+        while True:
+            try:
+                item = runner.output_queue.get_nowait()
+            except Empty:
+                self.root.after(self.update_interval, self._update_precompile, runner, chunks, locations)
+                return
+            if item.kind == 'stderr':
+                locations.extend(
+                    location._replace(start=location.start + offset, end=location.end + offset)
+                    for location in item.locations
+                )
+                chunks.append(item.chunk)
+                offset += len(item.chunk)
+            elif item.kind == 'exit':
+                break
+
+        self.precompile_runner = None
+        if item.reason is None:
+            self.show_diagnostics(''.join(chunks), locations)
+
+    def show_diagnostics(self, text, locations):
+        """
+        Marks the locations found in the compiler output in the input pane,
+        with the rest of their line as a tooltip.
+        """
+        self.clear_diagnostics()
+        for index, location in enumerate(locations):
+            line_end = text.find('\n', location.end)
+            message = text[location.end:line_end if line_end >= 0 else len(text)].lstrip(': ')
+            if location.col:
+                start = f'{location.row}.{location.col - 1}'
+                end = f'{start} wordend'
+            else:
+                start = f'{location.row}.0'
+                end = f'{start} lineend'
+            tag = f'diagnostic-{index}'
+            self.input_pane.tag_add('diagnostic', start, end)
+            self.input_pane.tag_add(tag, start, end)
+            self.input_pane.balloon.tagbind(self.input_pane, tag, message)
+        self._diagnostic_count = len(locations)
+
+    def clear_diagnostics(self):
+        self.input_pane.tag_remove('diagnostic', '1.0', tk.END)
+        for index in range(self._diagnostic_count):
+            tag = f'diagnostic-{index}'
+            self.input_pane.balloon.tagunbind(self.input_pane, tag)
+            self.input_pane.tag_delete(tag)
+        self._diagnostic_count = 0
+
+    def _show_check_result(self):
+        stderr = ''.join(text for style, text in self.spool.read(0, self.spool.size) if style[0] == 'stderr')
+        diagnostics = engine.parse_diagnostics(stderr)
+        self.diagnostics_table.set_rows(diagnostics)
+        if diagnostics:
+            # keep it below the output pane
+            ui_helpers.show_widget(self.diagnostics_table, before=self.output_pane)
+
+    def _goto_diagnostic(self, event):
+        diagnostic = self.diagnostics_table.selected_row()
+        if diagnostic is not None and diagnostic.row:
+            self.goto(diagnostic.row, max(diagnostic.col - 1, 0))
+
+    def goto(self, row, col):
+        self.input_pane.mark_set('insert', f'{row}.{col}')
+        self.input_pane.see('insert')
+        self.root.after(0, lambda: self.input_pane.focus_force())
+
+    def close(self):
+        self.stop_script()
+        self.cancel_precompile()
+        self.closed = True
+        self._reset_search()
+        self.waker.close()
+        if self.spool is not None:
+            self.spool.close()
+        self.app.notebook.forget(self.frame)
+        self.frame.destroy()
 
 
 class App:
@@ -90,15 +1018,23 @@ class App:
         with open(self._resolve_asset('sample.kt'), 'r') as f:
             self.default_script = f.read()
 
+        self.loop_thread = engine.EventLoopThread()
+        # left behind by sessions that crashed
+        threading.Thread(target=processes.reap_orphans, daemon=True).start()
+        self.daemon = daemon.ScriptDaemon()
+        self.cache = cache.ScriptCache()
+        self.scheduler = engine.Scheduler()
+        self.pool = pool.SparePool(0)
+        self.cds = cds.ClassDataArchive()
+        self._cds_label_job = None
+
+        self.tabs = []
+        self._tab_counter = 0
+        self.timing_records = []  # of all finished runs, see timings.record()
         self._init_ui()
-        self.output_queue = Queue()
+        self.new_tab(self.default_script)
 
     name = "Kotlin Workspace"
-    update_interval = 100  # ms
-
-    file_location_pattern = re.compile(
-        fr'{SCRIPT_BASENAME}(\.{SCRIPT_EXT})?:(?P<row>\d+)(?::(?P<col>\d+))?'
-    )
 
     def _init_ui(self):
         self.root = tk.Tk()
@@ -106,36 +1042,251 @@ class App:
         self.root.geometry('600x400')
         self.root.update()
 
-        self.buttonbar = tk.Frame(self.root)
-        self.buttonbar.pack(side='top', fill='x')
+        self._init_menu()
+
+        self.statusbar = tk.Frame(self.root)
+        self.statusbar.pack(side='bottom', fill='x')
+
+        self.cds_label = tk.Label(self.statusbar)
+        self.cds_label.pack(side='right')
+        self._add_tooltip(self.cds_label, "Class data archive for kotlinc")
+        ui_helpers.hide_widget(self.cds_label)
+
+        self.cache_label = tk.Label(self.statusbar)
+        self.cache_label.pack(side='right')
+        self._add_tooltip(self.cache_label, "Compiled script cache")
+        ui_helpers.hide_widget(self.cache_label)
+        self.update_cache_label()
+
+        self.notebook = tk.ttk.Notebook(self.root)
+        self.notebook.pack(side='top', fill='both', expand=True)
+
+    def _init_menu(self):
+        self.menubar = tk.Menu(self.root)
+        self.root.config(menu=self.menubar)
+
+        self.file_menu = tk.Menu(self.menubar, tearoff=False)
+        self.menubar.add_cascade(label="File", menu=self.file_menu)
+        self.file_menu.add_command(label="New tab", command=self.new_tab)
+        self.file_menu.add_command(label="Duplicate tab", command=self.duplicate_tab)
+        self.file_menu.add_command(label="Close tab", command=self.close_tab)
+        self.file_menu.add_separator()
+        self.file_menu.add_command(label="Save output...", command=self.save_output)
+        self.file_menu.add_command(
+            label="Find in output", accelerator="Ctrl+F", command=lambda: self.current_tab.show_search()
+        )
+        self.root.bind('<Control-f>', lambda event: self.current_tab.show_search())
+        self.file_menu.add_command(label="Export run timings...", command=self.export_timings)
 
-        self.input_pane = self._make_text_pane(self.root, width=1, height=1)
-        self.input_pane.pack(side='left', fill='both', expand=True)
-        self.input_pane.insert('1.0', self.default_script)
+        self.options_menu = tk.Menu(self.menubar, tearoff=False)
+        self.menubar.add_cascade(label="Options", menu=self.options_menu)
 
-        self.output_pane = self._make_text_pane(self.root, readonly=True, width=1, height=1)
-        self.output_pane.pack(side='right', fill='both', expand=True)
-        self.output_pane.tag_config('stderr', foreground='red')
-        self.output_pane.hyperlink_manager = ui_helpers.HyperlinkManager(self.output_pane)
+        self.use_daemon = tk.BooleanVar(self.root, False)
+        self.options_menu.add_checkbutton(
+            label="Keep a warm JVM for running scripts",
+            variable=self.use_daemon,
+            command=self._use_daemon_changed
+        )
 
-        self.run_button = self._make_button(self.buttonbar, "Run script", 'icon_run.png', self.run_script)
-        self.run_button.pack(side='left')
+        self.use_cache = tk.BooleanVar(self.root, False)
+        self.options_menu.add_checkbutton(
+            label="Cache compiled scripts",
+            variable=self.use_cache,
+            command=self._use_cache_changed
+        )
+        self.options_menu.add_command(label="Clear script cache", command=self.cache.clear)
 
-        self.stop_button = self._make_button(self.buttonbar, "Stop script", 'icon_stop.png', self.stop_script)
-        self.stop_button.pack(side='left')
+        self.precompile = tk.BooleanVar(self.root, False)
+        self.options_menu.add_checkbutton(
+            label="Compile while typing",
+            variable=self.precompile,
+            command=self._precompile_changed
+        )
 
-        self.loading_icon = self._make_animated_icon(self.buttonbar, 'loading.gif', "Running script...")
-        self.loading_icon.pack(side='right')
+        self.use_cds = tk.BooleanVar(self.root, False)
+        self.options_menu.add_checkbutton(
+            label="Share class data between kotlinc runs",
+            variable=self.use_cds,
+            command=self._use_cds_changed
+        )
+        self.options_menu.add_command(label="Recreate class data archive", command=self.recreate_cds_archive)
+
+        self.measure_usage = tk.BooleanVar(self.root, True)
+        self.options_menu.add_checkbutton(label="Monitor resource usage", variable=self.measure_usage)
+
+        # 0 means no limit
+        self.timeout = tk.IntVar(self.root, 0)  # s
+        self.cpu_limit = tk.IntVar(self.root, 0)  # s
+        self.memory_limit = tk.IntVar(self.root, 0)  # MiB
+        limits_menu = tk.Menu(self.options_menu, tearoff=False)
+        self.options_menu.add_cascade(label="Limits", menu=limits_menu)
+        for label, variable, choices in (
+            ("Time", self.timeout, [(10, "10 s"), (60, "1 min"), (600, "10 min")]),
+            ("CPU time", self.cpu_limit, [(10, "10 s"), (60, "1 min"), (600, "10 min")]),
+            ("Memory", self.memory_limit, [(512, "512 MiB"), (1024, "1 GiB"), (2048, "2 GiB"), (4096, "4 GiB")]),
+        ):
+            menu = tk.Menu(limits_menu, tearoff=False)
+            limits_menu.add_cascade(label=label, menu=menu)
+            for value, choice_label in [(0, "None")] + choices:
+                menu.add_radiobutton(label=choice_label, value=value, variable=variable)
+
+        self.spares = tk.IntVar(self.root, 0)
+        spares_menu = tk.Menu(self.options_menu, tearoff=False)
+        self.options_menu.add_cascade(label="Spare JVMs", menu=spares_menu)
+        for value in (0, 1, 2, 4):
+            spares_menu.add_radiobutton(
+                label=str(value), value=value, variable=self.spares,
+                command=self._spares_changed
+            )
 
-        self.success_icon = self._make_icon(self.buttonbar, 'icon_success.png', "Finished with exit code 0")
-        self.success_icon.pack(side='right')
-        ui_helpers.hide_widget(self.success_icon)
+        self.max_processes = tk.IntVar(self.root, 0)
+        parallel_menu = tk.Menu(self.options_menu, tearoff=False)
+        self.options_menu.add_cascade(label="Parallel runs", menu=parallel_menu)
+        for value, label in [(0, "Automatic")] + [(n, str(n)) for n in (1, 2, 4, 8)]:
+            parallel_menu.add_radiobutton(
+                label=label, value=value, variable=self.max_processes,
+                command=self._max_processes_changed
+            )
 
-        self.error_icon = self._make_icon(self.buttonbar, 'icon_error.png', "")
-        self.error_icon.pack(side='right')
-        ui_helpers.hide_widget(self.error_icon)
+    def _use_daemon_changed(self):
+        if self.use_daemon.get():
+            self.loop_thread.call(self.daemon.start_in_background)
+        else:
+            self.loop_thread.submit(self.daemon.shutdown())
+
+    def _use_cache_changed(self):
+        if self.use_cache.get() or self.precompile.get():
+            ui_helpers.show_widget(self.cache_label)
+        else:
+            ui_helpers.hide_widget(self.cache_label)
+
+    def _precompile_changed(self):
+        # runs need the cache to pick up the compiled scripts
+        self._use_cache_changed()
+        for tab in self.tabs:
+            if self.precompile.get():
+                tab.precompile()
+            else:
+                tab.cancel_precompile()
+                tab.clear_diagnostics()
+
+    def _use_cds_changed(self):
+        if self.use_cds.get():
+            ui_helpers.show_widget(self.cds_label)
+            self.cds.create_in_background()
+            self.update_cds_label()
+        else:
+            ui_helpers.hide_widget(self.cds_label)
+
+    def recreate_cds_archive(self):
+        if self.cds.creating:
+            return
+        self.cds.clear()
+        self.cds.create_in_background()
+        self.update_cds_label()
+
+    def _spares_changed(self):
+        self.loop_thread.call(self.pool.resize, self.spares.get())
+
+    def _max_processes_changed(self):
+        max_processes = self.max_processes.get() or None
+        self.loop_thread.call(setattr, self.scheduler, 'max_processes', max_processes)
+
+    def run_options(self):
+        """
+        Returns the options for engine.ScriptRun chosen in the menu.
+        """
+        return dict(
+            daemon=self.daemon if self.use_daemon.get() else None,
+            cache=self.cache if self.use_cache.get() or self.precompile.get() else None,
+            scheduler=self.scheduler,
+            pool=self.pool,
+            cds=self.cds if self.use_cds.get() else None,
+            measure_usage=self.measure_usage.get(),
+            timeout=self.timeout.get() or None,
+            cpu_limit=self.cpu_limit.get() or None,
+            memory_limit=self.memory_limit.get() * 2**20 or None
+        )
 
-        self.set_busy(False)
+    def precompile_options(self):
+        """
+        Returns the options for speculative compiles. They compile on the
+        same kind of JVM as runs (so with the same limits, which decide
+        whether the warm JVM is used), so that runs find the compiled scripts
+        in the cache.
+        """
+        return dict(self.run_options(), cache=self.cache, scheduler=None, measure_usage=False, timeout=None,
+                    speculative=True)
+
+    @property
+    def current_tab(self):
+        return self.tabs[self.notebook.index('current')]
+
+    def new_tab(self, script=''):
+        self._tab_counter += 1
+        tab = ScriptTab(self, f"Script {self._tab_counter}", script)
+        self.tabs.append(tab)
+        self.notebook.select(tab.frame)
+        tab.input_pane.focus_set()
+        return tab
+
+    def duplicate_tab(self):
+        return self.new_tab(self.current_tab.input_pane.get('1.0', 'end-1c'))
+
+    def close_tab(self):
+        if len(self.tabs) <= 1:
+            return
+        tab = self.current_tab
+        self.tabs.remove(tab)
+        tab.close()
+
+    def update_cache_label(self):
+        stats = self.cache.stats()
+        self.cache_label['text'] = (
+            f"Cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['saved_seconds']:.1f}s saved"
+        )
+
+    def save_output(self):
+        path = tk.filedialog.asksaveasfilename(
+            parent=self.root, title="Save output", defaultextension='.log',
+            filetypes=[("Log files", '*.log'), ("Text files", '*.txt')]
+        )
+        if not path:
+            return
+        self.current_tab.save_output(path)
+
+    def export_timings(self):
+        """
+        Appends the timings of the runs so far to a JSON-lines file and writes
+        them as a Chrome trace next to it.
+        """
+        path = tk.filedialog.asksaveasfilename(
+            parent=self.root, title="Export run timings", defaultextension='.jsonl',
+            filetypes=[("JSON lines", '*.jsonl')], confirmoverwrite=False
+        )
+        if not path:
+            return
+        timings.append_json_lines(path, self.timing_records)
+        timings.write_trace(f'{os.path.splitext(path)[0]}.trace.json', self.timing_records)
+
+    def update_cds_label(self):
+        state, size = self.cds.state()
+        if state == 'present':
+            self.cds_label['text'] = f"CDS: {size / 2**20:.0f} MiB"
+        elif self.cds.error is not None and state != 'creating':
+            self.cds_label['text'] = "CDS: failed"
+        else:
+            self.cds_label['text'] = f"CDS: {state}"
+        self.cds_label.balloon.unbind(self.cds_label)
+        self.cds_label.balloon.bind(self.cds_label, self.cds.error or "Class data archive for kotlinc")
+        # follow the creation, which runs in the background
+        if state == 'creating' and self._cds_label_job is None:
+            self._cds_label_job = self.root.after(500, self._poll_cds_label)
+
+    def _poll_cds_label(self):
+        self._cds_label_job = None
+        self.update_cds_label()
 
     def _add_tooltip(self, widget, text=None):
         if text is None: return
@@ -202,101 +1353,10 @@ class App:
         try:
             self.root.mainloop()
         finally:
-            self.stop_script()
-
-    @property
-    def busy(self):
-        return self.loading_icon.visible
-
-    def set_busy(self, busy):
-        self.loading_icon.visible = busy
-
-        self.run_button['state'] = 'disabled' if busy else 'normal'
-        self.stop_button['state'] = 'normal' if busy else 'disabled'
-
-    def run_script(self):
-        if self.busy:
-            return
-
-        self.set_busy(True)
-        ui_helpers.hide_widget(self.success_icon)
-        ui_helpers.hide_widget(self.error_icon)
-
-        script = self.input_pane.get('1.0', tk.END)
-
-        # clear output
-        with self.output_pane.unlocked():
-            self.output_pane.delete('1.0', tk.END)
-
-        # start script
-        self.script_thread = ScriptRunner(script, self.output_queue)
-        self.script_thread.start()
-
-        # start output loop
-        self.root.after(100, self.update_output)
-
-    def stop_script(self):
-        if not self.busy:
-            return
-
-        self.script_thread.stop()
-
-    def update_output(self):
-        while not self.output_queue.empty():
-            item = self.output_queue.get()
-            item_type = item[0]
-
-            if item_type == 'exit':
-                exit_code = item[1]
-                if exit_code == 0:
-                    ui_helpers.show_widget(self.success_icon)
-                else:
-                    self.error_icon.balloon.unbind(self.error_icon)
-                    self.error_icon.balloon.bind(self.error_icon, f"Finished with exit code {exit_code}")
-                    ui_helpers.show_widget(self.error_icon)
-                self.set_busy(False)
-                return
-
-            chunk = item[1]
-            if item_type == 'stdout':
-                with self.output_pane.unlocked():
-                    self.output_pane.insert(tk.END, chunk)
-            elif item_type == 'stderr':
-                with self.output_pane.unlocked():
-                    # Scan new chunk for error messages and add all alternating
-                    # matches/no-matches to the output pane with different
-                    # tags. We cannot add the tags later because
-                    # HyperlinkManager does not support tag_add.
-                    index = 0
-
-                    for match in self.file_location_pattern.finditer(chunk):
-                        self.output_pane.insert(tk.END, chunk[index:match.start()], 'stderr')
-
-                        row = int(match.group('row'))
-                        col = int(match.group('col')) if match.group('col') else 0
-                        start = f'1.0 + {match.start()} chars'
-                        end = f'1.0 + {match.end()} chars'
-                        self.output_pane.insert(
-                            tk.END,
-                            chunk[match.start():match.end()],
-                            self._make_goto_hyperlink(row, col - 1)
-                        )
-
-                        index = match.end()
-
-                    self.output_pane.insert(tk.END, chunk[index:], 'stderr')
-
-        self.root.after(self.update_interval, self.update_output)
-
-    def _make_goto_hyperlink(self, row, col):
-        return self.output_pane.hyperlink_manager.add(
-            lambda: self.goto(row, col)
-        )
-
-    def goto(self, row, col):
-        self.input_pane.mark_set('insert', f'{row}.{col}')
-        self.input_pane.see('insert')
-        self.root.after(0, lambda: self.input_pane.focus_force())
+            for tab in self.tabs:
+                tab.stop_script()
+            self.loop_thread.submit(self.daemon.shutdown()).result()
+            self.loop_thread.submit(self.pool.shutdown()).result()
 
 
 def main():
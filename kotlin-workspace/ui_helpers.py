@@ -1,27 +1,34 @@
+from array import array
+from bisect import bisect_right
+import collections
 import contextlib
 import itertools
+import os
 from PIL import Image, ImageTk
+import threading
 import tkinter.scrolledtext
+import tkinter.ttk
 import tkinter as tk
 
 
-hidden_widget_sides = {}
+hidden_widget_pack_infos = {}
 
 
 def hide_widget(widget):
     try:
-        hidden_widget_sides[widget] = widget.pack_info()['side']
+        info = widget.pack_info()
     except Exception:
         pass
+    else:
+        info.pop('in', None)
+        hidden_widget_pack_infos[widget] = info
     widget.pack_forget()
 
 
-def show_widget(widget):
-    try:
-        side = hidden_widget_sides.pop(widget)
-    except KeyError:
-        side = None
-    widget.pack(side=side)
+def show_widget(widget, **options):
+    info = hidden_widget_pack_infos.pop(widget, {})
+    info.update(options)
+    widget.pack(**info)
 
 
 class AnimatedImageLabel(tk.Label):
@@ -84,10 +91,17 @@ class HyperlinkManager:
     """
     Makes it possible to insert hyperlinks in a Tkinter Text widget.
 
+    All links share the tag "hyper". Their targets are kept in an index that
+    is sorted by character offsets, and clicking a link passes its target to
+    the command. Offsets are absolute, that is, they keep counting the
+    characters that have been deleted from the start of the widget through
+    forget_before() since the last reset().
+
     CREDITS: https://stackoverflow.com/a/50328110/13994294
     """
-    def __init__(self, text):
+    def __init__(self, text, command):
         self.text = text
+        self.command = command
         self.text.tag_config("hyper", foreground="blue", underline=1)
         self.text.tag_bind("hyper", "<Enter>", self._enter)
         self.text.tag_bind("hyper", "<Leave>", self._leave)
@@ -95,14 +109,52 @@ class HyperlinkManager:
         self.reset()
 
     def reset(self):
-        self.links = {}
-
-    def add(self, action):
-        # add an action to the manager.  returns tags to use in
-        # associated text widget
-        tag = "hyper-%d" % len(self.links)
-        self.links[tag] = action
-        return "hyper", tag
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.targets = []
+        self.deleted = 0
+
+    def offset(self, index):
+        """
+        Returns the absolute offset of a text index.
+        """
+        # Text.count() returns None, a tuple or an int depending on the Python
+        # version
+        return self.deleted + int(self.text.tk.call(self.text._w, 'count', '-chars', '1.0', index))
+
+    def add(self, start, end, target):
+        # add a link between two absolute offsets to the manager. returns
+        # tags to use in associated text widget
+        if self.starts and start < self.starts[-1]:
+            position = bisect_right(self.starts, start)
+            self.starts.insert(position, start)
+            self.ends.insert(position, end)
+            self.targets.insert(position, target)
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.targets.append(target)
+        return "hyper"
+
+    def shift(self, offset, delta):
+        """
+        To be called when delta characters have been inserted at (or deleted
+        after, if negative) the absolute offset, which must not be inside a
+        link.
+        """
+        for position in range(bisect_right(self.ends, offset), len(self.starts)):
+            self.starts[position] += delta
+            self.ends[position] += delta
+
+    def forget_before(self, index):
+        """
+        To be called right before the text up to index is deleted.
+        """
+        self.deleted = self.offset(index)
+        count = bisect_right(self.ends, self.deleted)
+        del self.starts[:count]
+        del self.ends[:count]
+        del self.targets[:count]
 
     def _enter(self, event):
         self.text.config(cursor="hand2")
@@ -111,10 +163,10 @@ class HyperlinkManager:
         self.text.config(cursor="")
 
     def _click(self, event):
-        for tag in self.text.tag_names(tk.CURRENT):
-            if tag[:6] == "hyper-":
-                self.links[tag]()
-                return
+        offset = self.offset(tk.CURRENT)
+        position = bisect_right(self.starts, offset) - 1
+        if position >= 0 and offset < self.ends[position]:
+            self.command(self.targets[position])
 
 
 class ReadOnlyText(tkinter.scrolledtext.ScrolledText):
@@ -148,3 +200,122 @@ class ReadOnlyText(tkinter.scrolledtext.ScrolledText):
         self.read_only = False
         yield
         self.read_only = True
+
+
+class SortableTable(tkinter.ttk.Treeview):
+    """
+    A table of rows (tuples with one value per column) that is sorted by a
+    column when its heading is clicked, and reversed when it is clicked again.
+    The ids of the items are the indices of their rows.
+    """
+    def __init__(self, master, columns, **kwargs):
+        super().__init__(master, columns=[name for name, _ in columns], show='headings', **kwargs)
+        for name, heading in columns:
+            self.heading(name, text=heading, command=lambda name=name: self.sort(name))
+        self.rows = []
+        self._sort_column = None
+        self._sort_reverse = False
+
+    def set_rows(self, rows):
+        self.delete(*self.get_children())
+        self.rows = list(rows)
+        for index, row in enumerate(self.rows):
+            self.insert('', tk.END, iid=str(index), values=row)
+        self._sort_column = None
+
+    def selected_row(self):
+        selection = self.selection()
+        return self.rows[int(selection[0])] if selection else None
+
+    def sort(self, column):
+        self._sort_reverse = column == self._sort_column and not self._sort_reverse
+        self._sort_column = column
+        position = self['columns'].index(column)
+        order = sorted(
+            range(len(self.rows)), key=lambda index: self.rows[index][position], reverse=self._sort_reverse
+        )
+        for place, index in enumerate(order):
+            self.move(str(index), '', place)
+
+
+class Sparkline(tk.Canvas):
+    """
+    A small line chart of the last max_values values. The scale grows with
+    the largest value shown (or is fixed if maximum is given).
+    """
+    def __init__(self, master, max_values=100, maximum=None, color='blue', width=60, height=18, **kwargs):
+        super().__init__(master, width=width, height=height, highlightthickness=0, **kwargs)
+        self.values = collections.deque(maxlen=max_values)
+        self.maximum = maximum
+        self.line = self.create_line(0, 0, 0, 0, fill=color)
+
+    def clear(self):
+        self.values.clear()
+        self.coords(self.line, 0, 0, 0, 0)
+
+    def add(self, value):
+        self.values.append(value)
+        if len(self.values) < 2:
+            return
+        width = int(self['width'])
+        height = int(self['height'])
+        maximum = self.maximum or max(self.values) or 1
+        step = width / (self.values.maxlen - 1)
+        offset = width - step * (len(self.values) - 1)
+        coordinates = []
+        for index, value in enumerate(self.values):
+            coordinates += [offset + index * step, height - 1 - (height - 2) * min(value, maximum) / maximum]
+        self.coords(self.line, *coordinates)
+
+
+class Waker:
+    """
+    Lets other threads wake up the Tk event loop to call the callback, through
+    a pipe that Tk watches (so this needs a Unix-like system). Wakeups that
+    arrive before the callback has run are merged into one.
+    """
+    def __init__(self, widget, callback):
+        self.widget = widget
+        self.callback = callback
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        self._pending = threading.Event()
+        # so that close() cannot close (and the system reuse) the fd while
+        # wake() writes to it
+        self._lock = threading.Lock()
+        self.widget.tk.createfilehandler(self._read_fd, tk.READABLE, self._readable)
+
+    def wake(self):
+        """
+        May be called from any thread.
+        """
+        if self._pending.is_set():
+            return
+        with self._lock:
+            if self._write_fd is None:
+                return
+            self._pending.set()
+            try:
+                os.write(self._write_fd, b'\0')
+            except BlockingIOError:
+                pass  # full, so the loop will wake up anyway
+
+    def _readable(self, fd, mask):
+        # clear first so that later wakeups are not lost
+        self._pending.clear()
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.callback()
+
+    def close(self):
+        with self._lock:
+            if self._write_fd is None:
+                return
+            os.close(self._write_fd)
+            self._write_fd = None
+        self.widget.tk.deletefilehandler(self._read_fd)
+        os.close(self._read_fd)
@@ -0,0 +1,24 @@
+import os
+import stat
+import sys
+
+import pytest
+
+# the modules of the workspace import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'kotlin-workspace'))
+
+import toolchain  # noqa: E402
+
+
+@pytest.fixture
+def fake_kotlinc(tmp_path, monkeypatch):
+    """
+    Returns a function that installs a fake KOTLINC in the PATH, which runs
+    the given shell commands instead of the script.
+    """
+    def install(commands):
+        path = tmp_path / toolchain.KOTLINC
+        path.write_text(f'#!/bin/sh\n{commands}\n')
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f'{tmp_path}{os.pathsep}{os.environ["PATH"]}')
+    return install
@@ -0,0 +1,32 @@
+import os
+import time
+
+import cache
+
+
+def compiled(script_cache, key, size):
+    jar = script_cache.partial_jar(key)
+    with open(jar, 'wb') as f:
+        f.write(b'\0' * size)
+    return jar
+
+
+def test_put_evicts_least_recently_used(tmp_path):
+    script_cache = cache.ScriptCache(str(tmp_path), max_size=250)
+    for key in ('a', 'b'):
+        script_cache.put(key, compiled(script_cache, key, 100), 1.0)
+        # mtimes of the entries must differ
+        time.sleep(0.01)
+    script_cache.get('a')
+    time.sleep(0.01)
+    script_cache.put('c', compiled(script_cache, 'c', 100), 1.0)
+    assert sorted(key for _, _, key in script_cache.entries()) == ['a', 'c']
+
+
+def test_put_keeps_jar_larger_than_max_size(tmp_path):
+    script_cache = cache.ScriptCache(str(tmp_path), max_size=50)
+    script_cache.put('a', compiled(script_cache, 'a', 10), 1.0)
+    path = script_cache.put('b', compiled(script_cache, 'b', 100), 1.0)
+    assert os.path.exists(path)
+    assert [key for _, _, key in script_cache.entries()] == ['b']
+    assert script_cache.get('b') == path
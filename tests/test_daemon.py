@@ -0,0 +1,124 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+import cache
+import daemon
+import engine
+
+
+FAKE_HOST = '''
+import socket, struct, sys, time
+token = sys.stdin.readline().strip()
+time.sleep(float(sys.argv[1]))  # like compiling the host on first use
+server = socket.socket()
+server.bind(('127.0.0.1', 0))
+server.listen(1)
+print('PORT', server.getsockname()[1], flush=True)
+while True:
+    connection, _ = server.accept()
+    request = connection.makefile('rb').readline().decode().rstrip('\\n').split('\\t')
+    if request[0] != token:
+        connection.close()
+    elif request[1] == 'ping':
+        connection.sendall(b'pong\\n')
+        connection.close()
+    elif request[1] == 'compile':
+        # fails if it is interrupted
+        connection.settimeout(1)
+        try:
+            interrupted = connection.recv(1) == b'c'
+        except socket.timeout:
+            interrupted = False
+        if not interrupted:
+            open(request[3], 'w').close()
+        connection.sendall(struct.pack('>cIi', b'x', 4, 1 if interrupted else 0))
+        connection.close()
+    else:
+        # a script that never ends and ignores cancellations
+        while True:
+            connection.sendall(struct.pack('>cI', b'o', 2) + b'.\\n')
+            time.sleep(0.1)
+'''
+
+
+@pytest.fixture
+def fake_host(tmp_path, monkeypatch):
+    """
+    Returns a function that makes ScriptDaemon start a fake host, which takes
+    startup_time s to start and then runs every script forever. Compiles take
+    1 s and fail if they are interrupted.
+    """
+    def install(startup_time=0):
+        path = tmp_path / 'host.py'
+        path.write_text(FAKE_HOST)
+        (tmp_path / 'build.txt').write_text('fake')
+        monkeypatch.setattr(daemon.toolchain, 'find_kotlin_home', lambda: str(tmp_path))
+        monkeypatch.setattr(
+            daemon.toolchain, 'host_command',
+            lambda kotlin_home, *args, jvm_options=(): [sys.executable, str(path), str(startup_time)]
+        )
+    return install
+
+
+def test_stop_while_daemon_starts(fake_host):
+    fake_host(startup_time=1)
+    script_daemon = daemon.ScriptDaemon()
+
+    async def main():
+        script_run = engine.ScriptRun('', daemon=script_daemon)
+        asyncio.get_event_loop().call_later(0.5, script_run.stop)
+        start = time.monotonic()
+        async def collect():
+            return [event async for event in script_run]
+        try:
+            # without the stop, the script would never end
+            events = await asyncio.wait_for(collect(), 10)
+        finally:
+            await script_daemon.shutdown()
+        return events, time.monotonic() - start
+
+    events, duration = asyncio.run(main())
+    assert events[-1].reason == 'stopped'
+    assert not any(event.kind == 'stdout' for event in events)
+    assert duration < 5
+
+
+def test_no_restart_after_shutdown(fake_host):
+    fake_host()
+    script_daemon = daemon.ScriptDaemon()
+
+    async def main():
+        run = asyncio.ensure_future(script_daemon.run('script.kts', lambda stream, chunk: None))
+        await asyncio.sleep(1)
+        await script_daemon.shutdown()
+        await run
+        # a restart would have been started in the background by now
+        await asyncio.sleep(0.5)
+        return script_daemon.process
+
+    assert asyncio.run(main()) is None
+
+
+def test_speculative_compile_is_not_interrupted(fake_host, tmp_path):
+    fake_host()
+    script_daemon = daemon.ScriptDaemon()
+    script_cache = cache.ScriptCache(str(tmp_path / 'cache'))
+
+    async def main():
+        await script_daemon.start()
+        script_run = engine.ScriptRun(
+            'println(1)', daemon=script_daemon, cache=script_cache, compile_only=True, speculative=True
+        )
+        asyncio.get_event_loop().call_later(0.5, script_run.stop)
+        try:
+            return [event async for event in script_run]
+        finally:
+            await script_daemon.shutdown()
+
+    events = asyncio.run(main())
+    assert events[-1].reason == 'stopped'
+    # the compile finished and was kept
+    assert script_cache.entries()
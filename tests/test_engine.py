@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import engine
+
+
+def run(script_run):
+    async def collect():
+        return [event async for event in script_run]
+    return asyncio.run(collect())
+
+
+def test_output_of_both_streams(fake_kotlinc):
+    fake_kotlinc('echo out; echo err >&2; exit 3')
+    events = run(engine.ScriptRun(''))
+    assert ''.join(event.chunk for event in events if event.kind == 'stdout') == 'out\n'
+    assert ''.join(event.chunk for event in events if event.kind == 'stderr') == 'err\n'
+    assert events[-1] == engine.Exit(3)
+
+
+def test_idle_cpu_while_script_sleeps(fake_kotlinc):
+    fake_kotlinc('sleep 2; echo done')
+    start_wall = time.monotonic()
+    start_cpu = time.process_time()
+    events = run(engine.ScriptRun(''))
+    cpu = time.process_time() - start_cpu
+    wall = time.monotonic() - start_wall
+    assert events[-1] == engine.Exit(0)
+    assert wall >= 2
+    # the pump blocks on the pipes instead of polling them
+    assert cpu / wall < 0.05
+
+
+def test_exit_after_internal_error(fake_kotlinc, monkeypatch):
+    fake_kotlinc('echo out')
+
+    def mkdtemp(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(engine.tempfile, 'mkdtemp', mkdtemp)
+    events = run(engine.ScriptRun('', scheduler=engine.Scheduler(max_processes=1)))
+    assert events[-1] == engine.Exit(1)
+    assert 'No space left on device' in ''.join(event.chunk for event in events if event.kind == 'stderr')
+
+
+def test_characters_split_across_writes(fake_kotlinc):
+    # é is \303\251 in UTF-8, written in two reads of the pump
+    fake_kotlinc(r"printf '\303'; sleep 0.2; printf '\251\n'")
+    events = run(engine.ScriptRun('', encoding='utf-8'))
+    assert ''.join(event.chunk for event in events if event.kind == 'stdout') == 'é\n'
+    assert events[-1] == engine.Exit(0)
+
+
+def test_location_split_across_chunks():
+    scanner = engine.LocationScanner()
+    assert scanner.feed('at script.k') == ('at ', [])
+    assert scanner.feed('ts:12:5: error\n') == ('script.kts:12:5: error\n', [engine.Location(0, 15, 12, 5)])
+    assert scanner.pending == ''
+
+
+def test_location_scanner_flush():
+    scanner = engine.LocationScanner()
+    assert scanner.feed('script.kts:3') is None
+    assert scanner.flush() == ('script.kts:3', [engine.Location(0, 12, 3, 0)])
+    assert scanner.flush() is None
+
+
+def test_location_scanner_does_not_hold_back_long_words():
+    scanner = engine.LocationScanner()
+    word = 'x' * (scanner.max_pending - 1)
+    assert scanner.feed(word) is None
+    assert scanner.feed('x') == (word + 'x', [])
+    assert scanner.pending == ''
@@ -0,0 +1,131 @@
+import folding
+
+
+TRACE = [
+    'Exception in thread "main" java.lang.IllegalStateException: boom\n',
+    '\tat Script.<init>(script.kts:3)\n',
+    '\tat java.base/jdk.internal.reflect.NativeConstructorAccessorImpl.newInstance0(Native Method)\n',
+    '\tat java.base/jdk.internal.reflect.NativeConstructorAccessorImpl.newInstance(Unknown Source)\n',
+    '\tat kotlin.script.experimental.jvm.RunnerKt.runCompiledScript(runner.kt:52)\n',
+]
+
+
+class Pane:
+    """
+    Applies the items of a LineFolder like the output pane does.
+    """
+    def __init__(self):
+        self.lines = []  # [text, label]
+        self.line_numbers = []
+
+    def apply(self, items):
+        for item in items:
+            if item[0] == 'text':
+                _, segments, line_numbers = item
+                text = ''.join(text for style, text in segments)
+                self.lines.extend([line, None] for line in text.splitlines(keepends=True))
+                self.line_numbers.extend(line_numbers)
+            else:
+                _, line_number, label = item
+                assert line_number == self.line_numbers[-1]
+                self.lines[-1][1] = label
+        assert len(self.lines) == len(self.line_numbers)
+
+
+def fold(lines, stream='stdout', chunk_lines=7):
+    """
+    Feeds the lines to a LineFolder in chunks and flushes it. Returns the
+    folder and the pane.
+    """
+    folder = folding.LineFolder()
+    pane = Pane()
+    for start in range(0, len(lines), chunk_lines):
+        pane.apply(folder.feed([((stream,), ''.join(lines[start:start + chunk_lines]))]))
+    pane.apply(folder.flush())
+    return folder, pane
+
+
+def test_repeated_lines():
+    folder, pane = fold(['retrying\n'] * 1000 + ['done\n'])
+    assert pane.lines == [['retrying\n', ' ×1000'], ['done\n', None]]
+    assert pane.line_numbers == [0, 1000]
+    assert folder.runs == {0: 1000}
+
+
+def test_lines_that_only_differ_in_numbers():
+    folder, pane = fold([f'attempt {number} failed after {number * 3} ms\n' for number in range(1, 501)])
+    assert pane.lines == [['attempt 1 failed after 3 ms\n', ' ×500']]
+
+
+def test_different_lines_are_not_folded():
+    lines = ['a\n', 'b\n', 'a\n', 'a1\n', 'b\n']
+    folder, pane = fold(lines, chunk_lines=2)
+    assert pane.lines == [[line, None] for line in lines]
+    assert folder.runs == {}
+
+
+def test_frames_are_folded_under_script_frame():
+    lines = TRACE + ['\tat Script.main(script.kts:9)\n', '\t... 12 more\n', 'after\n']
+    folder, pane = fold(lines, stream='stderr', chunk_lines=3)
+    assert pane.lines == [
+        [TRACE[0], None],
+        [TRACE[1], ' [+3 frames]'],
+        ['\tat Script.main(script.kts:9)\n', ' [+1 frame]'],
+        ['after\n', None],
+    ]
+    assert pane.line_numbers == [0, 1, 5, 7]
+    assert folder.runs == {1: 4, 5: 2}
+
+
+def test_repeated_traces_are_counted():
+    lines = TRACE * 50 + ['after\n']
+    folder, pane = fold(lines, stream='stderr')
+    assert pane.lines == [
+        [TRACE[0], None],
+        [TRACE[1], ' [+3 frames, trace ×50]'],
+        ['after\n', None],
+    ]
+    assert folder.runs == {1: 1 + 3 + 49 * len(TRACE)}
+
+
+def test_flush_releases_held_back_lines():
+    folder = folding.LineFolder()
+    pane = Pane()
+    pane.apply(folder.feed([(('stderr',), ''.join(TRACE + TRACE[:2]))]))
+    # the start of the trace might repeat the one before
+    assert len(pane.lines) == 2
+    pane.apply(folder.flush())
+    assert [text for text, label in pane.lines] == [TRACE[0], TRACE[1], TRACE[0], TRACE[1]]
+
+
+def test_held_back_lines_that_do_not_repeat_the_trace():
+    lines = TRACE + TRACE[:2] + ['\tat Script.other(script.kts:4)\n']
+    folder, pane = fold(lines, stream='stderr')
+    assert [text for text, label in pane.lines] == [TRACE[0], TRACE[1], TRACE[0], TRACE[1], lines[-1]]
+
+
+def test_expand_in_steps():
+    folder, pane = fold(['retrying\n'] * 1000 + ['done\n'])
+    assert folder.expand(0, 100) == (100, ' ×900')
+    assert folder.runs == {100: 900}
+    assert folder.expand(100, 100) == (100, ' ×800')
+    assert folder.expand(200, 1000) == (799, None)
+    assert folder.runs == {}
+
+
+def test_expand_the_last_run_and_keep_folding():
+    folder = folding.LineFolder()
+    folder.feed([(('stdout',), 'retrying\n' * 10)])
+    assert folder.expand(0, 4) == (4, ' ×6')
+    # the rest of the run is folded into the last unfolded line
+    items = folder.feed([(('stdout',), 'retrying\n' * 5)])
+    assert items == [('label', 4, ' ×11')]
+    assert folder.runs == {4: 11}
+
+
+def test_expand_compacted_run():
+    folder, pane = fold(TRACE * 3 + ['after\n'], stream='stderr')
+    count = folder.runs[1]
+    assert folder.expand(1, 2) == (2, f' [+{count - 3} lines]')
+    assert folder.runs == {3: count - 2}
+    assert folder.expand(3, count) == (count - 3, None)
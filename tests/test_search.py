@@ -0,0 +1,127 @@
+import re
+
+import pytest
+
+import search
+import spool
+
+
+@pytest.mark.parametrize('pattern, literals', [
+    ('NullPointerException', ['NullPointerException']),
+    (r'Exception in thread "main"', ['Exception in thread "main"']),
+    (r'java\.lang\.Error', ['java.lang.Error']),
+    (r'line\ttab\nnext', ['line\ttab\nnext']),
+    # unknown escapes and their arguments end a literal
+    (r'abc\x41BCdef', ['abc', 'BCdef']),
+    (r'abc\u0041def', ['abc', 'def']),
+    (r'abc\U00000041def', ['abc', 'def']),
+    (r'abc\N{LATIN SMALL LETTER A}def', ['abc', 'def']),
+    (r'abc\101def', ['abc', 'def']),
+    (r'(abc)\1def', ['def']),
+    (r'value\d+ end', ['value', ' end']),
+    # the character before ?, * or {} is optional
+    ('colou?r', ['colo']),
+    ('abcd*efg', ['abc', 'efg']),
+    ('abcd{2,3}efg', ['abc', 'efg']),
+    ('abcd+efg', ['abcd', 'efg']),
+    # the contents of groups might be optional
+    ('error(: fatal)? in main', ['error', ' in main']),
+    ('abc[xyz]def', ['abc', 'def']),
+    (r'abc[^]\]]def', ['abc', 'def']),
+    ('^Exception.*at line$', ['Exception', 'at line']),
+    # alternatives have no literal in common that is easy to tell
+    ('error|warning', []),
+    ('(?i)error', []),
+    ('ab', []),
+])
+def test_required_literals(pattern, literals):
+    assert search.required_literals(pattern) == literals
+
+
+def matches_in(text, pattern):
+    """
+    Returns the matches of the pattern as (line, column, length), like
+    OutputIndex.search().
+    """
+    line_starts = [0] + [match.end() for match in re.finditer('\n', text)]
+    matches = []
+    for match in pattern.finditer(text):
+        if match.start() == match.end():
+            continue
+        line = len([start for start in line_starts if start <= match.start()]) - 1
+        matches.append((line, match.start() - line_starts[line], match.end() - match.start()))
+    return matches
+
+
+@pytest.fixture
+def index():
+    """
+    An index of numbered lines in small blocks, which are appended to the
+    spool in chunks like the ones that the runner adds.
+    """
+    output = spool.OutputSpool()
+    output_index = search.OutputIndex(output)
+    output_index.block_size = 1000
+    output_index.scan_size = 300
+    output_index.overlap_size = 100
+    words = {number: 'Exception' for number in range(0, 2000, 97)}
+    words[1234] = 'needle'
+    lines = [f"line {number}: {words.get(number, 'value')} {number * 7 % 13}\n"
+             for number in range(2000)]
+    for start in range(0, len(lines), 10):
+        text = ''.join(lines[start:start + 10])
+        output_index.add(text)
+        output.append('stdout', text)
+    yield output_index
+    output.close()
+
+
+def search_all(index, pattern, flags=0):
+    compiled = re.compile(pattern, re.MULTILINE | flags)
+    matches = [match for matches in index.search(compiled, search.required_literals(pattern)) for match in matches]
+    text = ''.join(text for stream, text in index.spool.read_lines(0, index.spool.line_count))
+    return matches, matches_in(text, compiled)
+
+
+@pytest.mark.parametrize('pattern', [
+    'Exception',
+    '^line 1',
+    r'value \d+$',
+    r'line 19\d\d: value 3',
+    # across lines, and so across blocks and the pieces that are scanned
+    r'value 0\nline \d+: Exception',
+    r'Exception \d+\nline \d+: value \d+\nline',
+    r'\d\n.{4}',
+])
+def test_search_matches_scan(index, pattern):
+    assert len(index.blocks) > 10
+    matches, expected = search_all(index, pattern)
+    assert expected
+    assert matches == expected
+
+
+def test_search_skips_blocks(index, monkeypatch):
+    scanned = []
+    scan = search.OutputIndex._scan
+
+    def record(self, pattern, start, stop, line_count):
+        scanned.append((start, stop))
+        return scan(self, pattern, start, stop, line_count)
+    monkeypatch.setattr(search.OutputIndex, '_scan', record)
+    matches, expected = search_all(index, 'needle')
+    assert matches == expected
+    assert sum(stop - start for start, stop in scanned) < index.spool.line_count / 4
+
+
+def test_search_case_insensitive(index):
+    matches, expected = search_all(index, 'EXCEPTION', re.IGNORECASE)
+    assert expected
+    assert matches == expected
+
+
+def test_search_unterminated_last_line(index):
+    index.add('last Exception')
+    index.spool.append('stdout', 'last Exception')
+    matches, expected = search_all(index, 'Exception$')
+    assert matches[-1] == (2000, 5, 9)
+    assert matches == expected
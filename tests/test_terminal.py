@@ -0,0 +1,94 @@
+import terminal
+
+
+def text_of(segments):
+    return ''.join(text for style, text in segments)
+
+
+def test_redraws_leave_one_line():
+    term = terminal.Terminal()
+    committed = []
+    for percent in range(100000):
+        committed += term.feed('stdout', f'\r[{"#" * (percent // 5000):20}] {percent // 1000}%')
+    assert committed == []
+    committed += term.feed('stdout', '\n')
+    assert committed == [(('stdout',), f'[{"#" * 19:20}] 99%\n')]
+    assert term.line == []
+
+
+def test_redraw_of_shorter_text_keeps_the_rest():
+    term = terminal.Terminal()
+    assert term.feed('stdout', 'abcdef\rxy\n') == [(('stdout',), 'xycdef\n')]
+
+
+def test_erase_line():
+    term = terminal.Terminal()
+    # from the cursor to the end
+    assert text_of(term.feed('stdout', 'abcdef\x1b[3D\x1b[K\n')) == 'abc\n'
+    assert text_of(term.feed('stdout', 'abcdef\x1b[3D\x1b[0K\n')) == 'abc\n'
+    # from the start to the cursor
+    assert text_of(term.feed('stdout', 'abcdef\x1b[3D\x1b[1K\n')) == '    ef\n'
+    # the whole line, the cursor stays
+    assert text_of(term.feed('stdout', 'abcdef\x1b[2Kxy\n')) == '      xy\n'
+
+
+def test_changes_of_the_current_line():
+    term = terminal.Terminal()
+    term.feed('stdout', 'abcdef')
+    assert term.take_changes() == 0
+    assert term.take_changes() is None
+    term.feed('stdout', '\x1b[4Gxy')
+    assert term.take_changes() == 3
+    assert text_of(term.line_segments(3)) == 'xyf'
+
+
+def test_colors():
+    term = terminal.Terminal()
+    segments = term.feed('stdout', '\x1b[31mred\x1b[0m plain \x1b[1;94mbold blue\x1b[39;22m\n')
+    assert segments == [
+        (('stdout', 'ansi-fg-red'), 'red'),
+        (('stdout',), ' plain '),
+        (('stdout', 'ansi-fg-bright-blue', 'ansi-bold'), 'bold blue'),
+        (('stdout',), '\n'),
+    ]
+
+
+def test_256_and_true_colors():
+    term = terminal.Terminal()
+    segments = term.feed(
+        'stdout',
+        '\x1b[38;5;1ma\x1b[38;5;46mb\x1b[38;5;255mc\x1b[48;5;21md\x1b[0m'
+        '\x1b[38;2;250;10;10me\x1b[38;2;0;0;0mf\x1b[48;2;0;200;200mg\x1b[0m\n'
+    )
+    assert segments == [
+        (('stdout', 'ansi-fg-red'), 'a'),
+        (('stdout', 'ansi-fg-bright-green'), 'b'),
+        (('stdout', 'ansi-fg-white'), 'c'),
+        (('stdout', 'ansi-fg-white', 'ansi-bg-blue'), 'd'),
+        (('stdout', 'ansi-fg-bright-red'), 'e'),
+        (('stdout', 'ansi-fg-black'), 'f'),
+        (('stdout', 'ansi-fg-black', 'ansi-bg-cyan'), 'g'),
+        (('stdout',), '\n'),
+    ]
+
+
+def test_streams_keep_their_colors():
+    term = terminal.Terminal()
+    term.feed('stderr', '\x1b[31m')
+    segments = term.feed('stdout', 'out ') + term.feed('stderr', 'err\n')
+    assert segments == [(('stdout',), 'out '), (('stderr', 'ansi-fg-red'), 'err\n')]
+
+
+def test_escape_sequences_split_across_chunks():
+    term = terminal.Terminal()
+    segments = []
+    for chunk in ('a\x1b', '[3', '1', 'mb\x1b]0;ti', 'tle\x07c\x1b[0', 'm\r\n'):
+        segments += term.feed('stdout', chunk)
+    assert segments == [(('stdout',), 'a'), (('stdout', 'ansi-fg-red'), 'bc'), (('stdout',), '\n')]
+
+
+def test_flush_completes_the_last_line():
+    term = terminal.Terminal()
+    assert term.feed('stdout', 'done\nlast') == [(('stdout',), 'done\n')]
+    assert term.flush() == [(('stdout',), 'last')]
+    assert term.flush() == []
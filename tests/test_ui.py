@@ -0,0 +1,85 @@
+from queue import Queue
+import time
+import tkinter as tk
+
+import pytest
+
+import engine
+import terminal
+import ui
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    An App whose caches are in tmp_path. Skips the test if there is no
+    display (e.g., run it under xvfb-run).
+    """
+    try:
+        tk.Tk().destroy()
+    except tk.TclError as e:
+        pytest.skip(f"needs a display: {e}")
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    app = ui.App()
+    yield app
+    for tab in app.tabs:
+        tab.stop_script()
+    app.root.destroy()
+
+
+def collect(runner, timeout=30):
+    """
+    Returns the items that the runner puts into its queue until the exit.
+    """
+    runner.start()
+    items = []
+    while not items or items[-1].kind != 'exit':
+        items.append(runner.output_queue.get(timeout=timeout))
+    return items
+
+
+def test_runner_exits_after_internal_error(fake_kotlinc, monkeypatch):
+    fake_kotlinc('echo out; sleep 30')
+
+    def feed(self, stream, text):
+        raise ValueError('broken terminal')
+    monkeypatch.setattr(terminal.Terminal, 'feed', feed)
+    loop_thread = engine.EventLoopThread()
+    start = time.monotonic()
+    items = collect(ui.ScriptRunner(loop_thread, '', Queue(), emulate_terminal=True))
+    assert items[-1] == engine.Exit(1)
+    assert 'broken terminal' in ''.join(text for style, text in items[-2].segments)
+    # the script has been stopped
+    assert time.monotonic() - start < 10
+
+
+def run(tab, timeout=30):
+    """
+    Runs the script of the tab and processes the events of Tk until the run
+    has finished.
+    """
+    tab.run_script()
+    deadline = time.monotonic() + timeout
+    while tab.busy:
+        assert time.monotonic() < deadline
+        tab.root.update()
+        time.sleep(0.01)
+
+
+def test_search_resumes_after_current_match(app, fake_kotlinc):
+    fake_kotlinc('for i in $(seq 10); do echo "line $i: needle"; done')
+    tab = app.current_tab
+    run(tab)
+    tab.search_entry.insert(0, 'needle')
+    tab.find_next()
+    tab.find_next()
+    assert tab.match_index == 1
+    assert tab.search_label['text'] == "2 of 10 matches"
+
+    # as if more output had come in
+    text = 'line 11: needle\n'
+    tab.search_index.add(text)
+    tab._commit_output([(tab.spool.streams[-1], text)])
+    tab.find_next()
+    assert tab.search_label['text'] == "3 of 11 matches"
+    assert tab.search_matches[tab.match_index] == (2, 8, 6)